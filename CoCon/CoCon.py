@@ -7,10 +7,19 @@ Site: https://github.com/DominiqueMakowski/CoCon.py
 """
 
 import numpy as np
-import pandas as pd
-import neuropsydia as n
 import datetime
-import scipy
+
+import cohort
+import collector
+import responses
+import schedules
+import scoring
+import sequences
+import stimuli
+import storage
+import timing
+import tracing
+import triallog
 
 #==============================================================================
 # Infos
@@ -21,58 +30,177 @@ version = "1.0"
 #==============================================================================
 # Initialization
 #==============================================================================
-angle_to_orientation = {-90:"LEFT", 90:"RIGHT", 0:"DOWN", 180:"UP", "NA":"NA"}
-# Colors contrasts
-colors_ref = {"white": (255, 255, 255),
-              "red": (255, 85, 54),
-              "yellow": (255,235,59),
-              "blue": (33,150,243)}
 testmode = True
+# Set to give each participant the same trial sequences at every run
+seed = None
+# Order the trials under the constraints of schedules.py (from the pool of the station if built)
+constrained_sequences = False
+# Adaptive blocks: end a block once the SE (ms) of its RTs reaches this precision (None: fixed blocks)
+adaptive_se = None
+adaptive_min_trials = 20
+# "host:port" of a collector to send each session to (see collector.py), or None
+collector_address = None
+# Longest wait for the collector once the end screen is closed (s)
+upload_wait = 10
+# Folder of a cohort store to add each session to (see cohort.py), or None
+cohort_path = None
+# Set to save a trace of the phases and trials of each session in ./Data/Traces/ (see tracing.py)
+trace = False
+# Refresh rate of the screen (Hz): prestimulus intervals are whole numbers of refreshes
+refresh_rate = 60
+# Set to capture key presses in a background thread, stamped as they arrive (see responses.py)
+capture_responses = False
+# "csv" (through neuropsydia), or "parquet" / "feather" (see storage.py)
+data_format = "csv"
+# neuropsydia, imported by main() when a session starts (or another display, see headless.py)
+n = None
 
 
 #==============================================================================
 # Trial
 #==============================================================================
-def run_trials(cache, trials):
+def stop_block(scorer, condition, kinds, design):
+    """
+    Whether an adaptive block can end after the trials run so far (of the given kinds): the RTs of
+    its conditions are precise enough, and each kind of trial has had at least its share.
+    """
+    done = len(kinds)
+    if done < adaptive_min_trials or done == len(condition):
+        return(False)
+    share = np.bincount(kinds, minlength=len(design)) >= np.floor(design * done / len(condition))
+    se = scorer.se()[np.unique(condition[condition >= 0])]
+    return(bool(share.all() and (se <= adaptive_se).all()))
+
+
+
+def run_trials(cache, trials, log=None, scorer=None):
+    stimuli_list = stimuli.trial_stimuli(trials)
+    condition, trial_type = sequences.block_codes(trials)
+    expected = sequences.expected_responses(trials)
+    if adaptive_se is not None:
+        if scorer is None:
+            scorer = scoring.OnlineScorer()
+        # Kinds of trial (no-go, no-response...), kept in proportion when a block ends early
+        kinds = np.unique(condition.astype(int)*4 + trial_type, return_inverse=True)[1]
+        design = np.bincount(kinds)
+    # The clock of the display if it has one (e.g., the virtual clock of headless.py)
+    clock = timing.Clock(getattr(n, "perf_counter_ns", None))
+    listener = None
+    if capture_responses is True and testmode is False:
+        listener = responses.KeyListener(counter=clock.counter, sleep=getattr(n, "sleep", None)).start()
+
+    # A display with its own clock (virtual) only moves it when slept: no spinning
+    if hasattr(n, "perf_counter_ns"):
+        scheduler = timing.Scheduler(clock.counter, n.sleep, getattr(n, "refresh_rate", refresh_rate), spin=0)
+    else:
+        scheduler = timing.Scheduler(clock.counter, refresh_rate=refresh_rate)
+    if listener is not None:
+        # Key presses are drained during the prestimulus waits
+        scheduler.sleep = listener.sleep
 
-    prestim_interval = list(np.random.uniform(33.333333, 2000, len(trials)-1))
+    # Prestimulus intervals of the whole block, in refreshes
+    prestim_interval = list(np.random.uniform(33.333333, 2000, len(trials["RT"])-1))
     prestim_interval.insert(0, 2000)
+    prestim_interval = scheduler.plan(prestim_interval)
 
 
-    for order, trial in enumerate(trials):
+    for order in range(len(trials["RT"])):
+        steps = tracing.steps("Trial", "trial", order=order+1)
+        steps.mark("Refresh")
         n.refresh()
-        trial["Order"] = order+1
-        trial["Time_Trial_Onset"] = datetime.datetime.now()
+        trial_start = clock.now()
+        trials["Order"][order] = order+1
+        trials["Time_Trial_Onset"][order] = clock.datetime(trial_start)
+        if listener is not None:
+            # Late presses of the previous trial
+            listener.discard()
+
+        # Global and local stimuli as a single image (normally composited already)
+        steps.mark("Stimulus")
+        stimulus = cache.compose(stimuli_list[order])
 
         # Wait
-        trial["Prestimulus_Interval"] = int(prestim_interval[order])
+        steps.mark("Prestimulus")
+        trials["Prestimulus_Interval"][order] = prestim_interval[order]
+        planned_onset = trial_start + int(round(prestim_interval[order] * 1e6))
+        wait_end = planned_onset - int(round(scheduler.frame * 1e6 / 2))
+        if log is not None:
+            # The log of the previous trials is written during the wait only
+            log.release(max(wait_end - clock.now(), 0) / 1e9)
         if testmode is False:
-            trial["Prestimulus_Interval"] = n.time.wait(int(prestim_interval[order]))
-
-        # Diplay stuff
-        n.image(trial["Global_Color"] + "_" + trial["Global_Shape"], size=8, extension = ".png", cache = cache, path = "./Stimuli/", rotate=trial["Global_Angle"])
-        n.image(trial["Local_Color"] + "_" + trial["Local_Shape"], size=8, extension = ".png", cache = cache, path = "./Stimuli/", rotate=trial["Local_Angle"])
-
+            # Until half a refresh before the onset: the stimulus is drawn meanwhile, and shown at the refresh of the onset
+            trials["Prestimulus_Overshoot"][order] = scheduler.wait_until(wait_end)
+            if listener is not None:
+                listener.pump()
+
+        # Diplay stuff (no log written until the next prestimulus interval)
+        if log is not None:
+            log.hold()
+        steps.mark("Draw")
+        draw_start = clock.now()
+        n.image(stimulus, size=stimuli.stimuli_size, extension = ".png", cache = cache, path = stimuli.stimuli_path)
+        steps.mark("Flip")
+        refresh_start = clock.now()
         n.refresh()
-        trial["Time_Stimulus_Onset"] = datetime.datetime.now()
+        onset = clock.now()
+        trials["Draw_Duration"][order] = clock.ms(draw_start, refresh_start)
+        trials["Refresh_Duration"][order] = clock.ms(refresh_start, onset)
+        trials["Time_Stimulus_Onset"][order] = clock.datetime(onset)
+        if testmode is False:
+            trials["Onset_Error"][order] = clock.ms(planned_onset, onset)
 
+        steps.mark("Response")
         if testmode is False:
-            answer, RT = n.response(time_max = 1750, allow=["DOWN", "RIGHT", "LEFT"])
+            trials["Response_Latency"][order] = clock.ms(onset)
+            if listener is None:
+                answer, RT = n.response(time_max = 1750, allow=["DOWN", "RIGHT", "LEFT"])
+            else:
+                # Presses of the prestimulus interval, then the first press after the onset
+                early = listener.anticipations(onset)
+                trials["Anticipations"][order] = len(early)
+                if len(early) > 0:
+                    trials["Anticipation_Time"][order] = clock.ms(early[-1][0], onset)
+                if "ESCAPE" in [key for ns, key in early]:
+                    press = (onset, "ESCAPE")
+                else:
+                    press = listener.wait(allow=["DOWN", "RIGHT", "LEFT", "ESCAPE"], deadline=onset + 1750*10**6)
+                answer, RT = ("Time_Max_Exceeded", clock.ms(onset)) if press is None else (press[1], clock.ms(onset, press[0]))
+            if answer == "ESCAPE":
+                if listener is not None:
+                    listener.stop()
+                # The trials done so far can be recovered from the log (see triallog.py)
+                raise KeyboardInterrupt("CoCon: the task was aborted (ESCAPE).")
+            # Time from the onset not accounted for in the RT
+            trials["Response_Offset"][order] = clock.ms(onset) - RT
             if answer == "Time_Max_Exceeded":
                 answer = "NA"
         else:
             answer = np.random.choice(["DOWN", "RIGHT", "LEFT", "NA"])
             RT = np.random.uniform(100, 1750)
-        trial["Response"] = answer
-        trial["RT"] = RT
-
-
+        steps.mark("Record")
+        trials["Response"][order] = sequences.categories["Response"].index(answer)
+        trials["RT"][order] = RT
+        if scorer is not None:
+            correct = trials["Response"][order] == expected[order]
+            scorer.update(condition[order], trial_type[order], correct, RT, correct and not np.isnan(trials["Response_Correct"][order]))
+        if log is not None:
+            log.append(trials, order)
+
+        steps.mark("Clear")
         n.newpage('grey', auto_refresh=False)
+        steps.end()
 
+        if adaptive_se is not None and stop_block(scorer, condition, kinds[:order+1], design):
+            trials = {column: values[:order+1] if isinstance(values, np.ndarray) else values for column, values in trials.items()}
+            break
 
+    if listener is not None:
+        listener.stop()
+    if log is not None:
+        # Between blocks
+        log.release()
     return(trials)
 
-
 #==============================================================================
 # Processing
 #==============================================================================
@@ -81,365 +209,41 @@ def statistics(data):
     n.write("Veuillez patienter...", y=-9, color="blue")
     n.refresh()
 
-    df = pd.DataFrame.from_dict(data)
-
-    # Scores
-    df["Response_Correct_Orientation"] = [angle_to_orientation[angle] for angle in df["Response_Correct"]]
-    df["Correct"] = np.where(df["Response"]==df["Response_Correct_Orientation"], 1, 0)
-    df["Color_Congruence"] = np.where(df["Local_Color"]==df["Global_Color"], True, False)
-
-    # Response Type - STD
-#    df = df.reset_index()
-#    response_type = []
-#    for row in range(len(df)):
-#        if df["Correct"][row]==1 and df["Response_Correct_Orientation"][row]!="NA":
-#            response_type.append("Hit")
-#        if df["Correct"][row]==1 and df["Response_Correct_Orientation"][row]=="NA":
-#            response_type.append("Correct_Rejection")
-#        if df["Correct"][row]==0 and df["Response_Correct_Orientation"][row]!="NA":
-#            response_type.append("Miss")
-#        if df["Correct"][row]==0 and df["Response_Correct_Orientation"][row]=="NA":
-#            response_type.append("False_Alarm")
-#    df["Response_Type"] = response_type
-
-
-
-    # Luminance and contrast
-    luminance_global = []
-    luminance_local = []
-    contrast = []
-    for row in range(len(df)):
-        luminance_global.append(n.color_luminance(colors_ref[df["Global_Color"][row]]))
-        luminance_local.append(n.color_luminance(colors_ref[df["Local_Color"][row]]))
-        contrast.append(n.color_contrast(colors_ref[df["Global_Color"][row]], colors_ref[df["Local_Color"][row]]))
-    df["Luminance_Global"] = luminance_global
-    df["Luminance_Local"] = luminance_local
-    df["Contrast"] = contrast
-
-    if df["Condition_Conflict"].values[0] == False:
-        dfs = [df.reindex()]
-    else:
-        dfs = [df[df["Conflict"]=="Congruent"].sort_values("Order").reindex(), df[df["Conflict"]=="Incongruent"].sort_values("Order").reindex()]
-
-    for data in dfs:
-        cumulative_average = []
-        cumulative_sd = []
-        cumulative_se = []
-        for row in range(len(data)):
-            global sliced
-            sliced = data.loc[0:row]
-            sliced = sliced[(sliced["Correct"]==1) & (sliced["Response_Correct"].map(str)!="NA")]["RT"]
-            cumulative_average.append(sliced.mean())
-            cumulative_sd.append(sliced.std())
-            if len(sliced.dropna()) > 1:
-                cumulative_se.append(scipy.stats.sem(sliced))
-            else:
-                cumulative_se.append(np.nan)
-        data["Cumulative_Average"] = cumulative_average
-        data['Cumulative_SD'] = cumulative_sd
-        data['Cumulative_SE'] = cumulative_se
-    df = pd.concat(dfs)
-    df.sort_values("Order")
-    df = df.replace("NA", np.nan)
+    return(scoring.statistics(sequences.trial_frame(data)))
 
-    return(df)
 
 #==============================================================================
 # Sequence
 #==============================================================================
-def sequence(cache, response_selection="None", inhibition=False, conflict=False):
+def block_trials(response_selection="None", inhibition=False, conflict=False, rng=None, pool=None):
+    """
+    Trials of a block, in presentation order: under the constraints of schedules.py, or shuffled
+    (and interleaved in adaptive blocks). Constrained orders already spread each kind of trial
+    evenly over the block, so adaptive blocks keep them as they are.
+    """
+    if constrained_sequences is True:
+        return(schedules.trial_store(response_selection, inhibition, conflict, rng=rng, pool=pool))
+    trials = sequences.trial_store(response_selection, inhibition, conflict, rng=rng)
+    if adaptive_se is not None:
+        trials = sequences.interleave(trials, rng)
+    return(trials)
+
+
 
+def sequence(cache, response_selection="None", inhibition=False, conflict=False, rng=None, log=None, scorer=None, pool=None):
 
+    phases = tracing.steps("Block", response_selection=response_selection, inhibition=inhibition, conflict=conflict)
 
     # Sequence Preparation
-    if response_selection == "None":
-        trials = []
-        for i in range(30):
-            trial = {
-"Condition_Response_Selection":response_selection,
-"Condition_Inhibition":inhibition,
-"Condition_Conflict":conflict,
-"Global_Shape":"circle",
-"Global_Color":np.random.choice(["red", "yellow", "blue", "white"]),
-"Global_Angle":0,
-"Local_Shape":"local",
-"Local_Color":np.random.choice(["red", "yellow", "blue", "white"]),
-"Local_Angle":np.random.choice([-90, 0, 90, 180]),
-"Inhibition":False,
-"Conflict":"Neutral",
-"Response_Availability":True,
-"Response_Correct":0
-            }
-            trials.append(trial)
-    if response_selection == "Conditional":
-        if conflict is False:
-            if inhibition is False:
-                trials = []
-                correct_responses = {-90:-90, 0:0, 90:90, 180:"NA"}
-                for i in range(30):
-                    trial = {
-"Condition_Response_Selection":response_selection,
-"Condition_Inhibition":inhibition,
-"Condition_Conflict":conflict,
-"Global_Shape":"circle",
-"Global_Color":np.random.choice(["red", "yellow", "blue", "white"]),
-"Global_Angle":0,
-"Local_Shape":"local",
-"Local_Color":np.random.choice(["red", "yellow", "blue", "white"]),
-"Local_Angle":np.random.choice([-90, 0, 90]),
-"Inhibition":False,
-"Conflict":"Neutral",
-"Response_Availability":True
-                    }
-                    trial["Response_Correct"] = correct_responses[trial["Local_Angle"]]
-                    trials.append(trial)
-                for i in range(3):
-                    trial = {
-"Condition_Response_Selection":response_selection,
-"Condition_Inhibition":inhibition,
-"Condition_Conflict":conflict,
-"Global_Shape":"circle",
-"Global_Color":np.random.choice(["red", "yellow", "blue", "white"]),
-"Global_Angle":0,
-"Local_Shape":"local",
-"Local_Color":np.random.choice(["red", "yellow", "blue", "white"]),
-"Local_Angle":180,
-"Inhibition":False,
-"Conflict":"Neutral",
-"Response_Availability":False,
-"Response_Correct":"NA"
-                    }
-                    trials.append(trial)
-                np.random.shuffle(trials)
-            else:
-                trials = []
-                correct_responses = {-90:-90, 0:0, 90:90, 180:"NA"}
-                for i in range(40):
-                    trial = {
-"Condition_Response_Selection":response_selection,
-"Condition_Inhibition":inhibition,
-"Condition_Conflict":conflict,
-"Global_Shape":"circle",
-"Global_Color":np.random.choice(["red", "yellow", "blue"]),
-"Global_Angle":0,
-"Local_Shape":"local",
-"Local_Color":np.random.choice(["red", "yellow", "blue"]),
-"Local_Angle":np.random.choice([-90, 0, 90]),
-"Inhibition":False,
-"Conflict":"Neutral",
-"Response_Availability":True
-                    }
-                    trial["Response_Correct"] = correct_responses[trial["Local_Angle"]]
-                    trials.append(trial)
-                for i in range(3):
-                    trial = {
-"Condition_Response_Selection":response_selection,
-"Condition_Inhibition":inhibition,
-"Condition_Conflict":conflict,
-"Global_Shape":"circle",
-"Global_Color":np.random.choice(["red", "yellow", "blue"]),
-"Global_Angle":0,
-"Local_Shape":"local",
-"Local_Color":np.random.choice(["red", "yellow", "blue"]),
-"Local_Angle":180,
-"Inhibition":False,
-"Conflict":"Neutral",
-"Response_Availability":False,
-"Response_Correct":"NA"
-                    }
-                    trials.append(trial)
-                for i in range(6):
-                    trial = {
-"Condition_Response_Selection":response_selection,
-"Condition_Inhibition":inhibition,
-"Condition_Conflict":conflict,
-"Global_Shape":"circle",
-"Global_Color":"white",
-"Global_Angle":0,
-"Local_Shape":"local",
-"Local_Color":np.random.choice(["red", "yellow", "blue"]),
-"Local_Angle":np.random.choice([-90, 0, 90]),
-"Inhibition":True,
-"Conflict":"Neutral",
-"Response_Availability":True,
-"Response_Correct":"NA"
-                    }
-                    trials.append(trial)
-                for i in range(3):
-                    trial = {
-"Condition_Response_Selection":response_selection,
-"Condition_Inhibition":inhibition,
-"Condition_Conflict":conflict,
-"Global_Shape":"circle",
-"Global_Color":"white",
-"Global_Angle":0,
-"Local_Shape":"local",
-"Local_Color":np.random.choice(["red", "yellow", "blue"]),
-"Local_Angle":180,
-"Inhibition":True,
-"Conflict":"Neutral",
-"Response_Availability":False,
-"Response_Correct":"NA"
-                    }
-                    trials.append(trial)
-                np.random.shuffle(trials)
-        else:
-            trials = []
-            correct_responses = {-90:-90, 0:0, 90:90, 180:"NA"}
-            for i in range(40):
-                trial = {
-"Condition_Response_Selection":response_selection,
-"Condition_Inhibition":inhibition,
-"Condition_Conflict":conflict,
-"Global_Shape":"global",
-"Global_Color":np.random.choice(["red", "yellow", "blue"]),
-"Local_Shape":"local",
-"Local_Color":np.random.choice(["red", "yellow", "blue"]),
-"Local_Angle":np.random.choice([-90, 0, 90]),
-"Inhibition":False,
-"Conflict":"Incongruent",
-"Response_Availability":True
-                }
-                trial["Response_Correct"] = correct_responses[trial["Local_Angle"]]
-                if trial["Local_Angle"] in [-90, 0]:
-                    trial["Global_Angle"] = trial["Local_Angle"] + 180
-                else:
-                    trial["Global_Angle"] = trial["Local_Angle"] - 180
-                trials.append(trial)
-            for i in range(3):
-                trial = {
-"Condition_Response_Selection":response_selection,
-"Condition_Inhibition":inhibition,
-"Condition_Conflict":conflict,
-"Global_Shape":"global",
-"Global_Color":np.random.choice(["red", "yellow", "blue"]),
-"Local_Shape":"local",
-"Local_Color":np.random.choice(["red", "yellow", "blue"]),
-"Local_Angle":180,
-"Inhibition":False,
-"Conflict":"Incongruent",
-"Response_Availability":False,
-"Response_Correct":"NA"
-                }
-                if trial["Local_Angle"] in [-90, 0]:
-                    trial["Global_Angle"] = trial["Local_Angle"] + 180
-                else:
-                    trial["Global_Angle"] = trial["Local_Angle"] - 180
-                trials.append(trial)
-            for i in range(6):
-                trial = {
-"Condition_Response_Selection":response_selection,
-"Condition_Inhibition":inhibition,
-"Condition_Conflict":conflict,
-"Global_Shape":"global",
-"Global_Color":"white",
-"Local_Shape":"local",
-"Local_Color":np.random.choice(["red", "yellow", "blue"]),
-"Local_Angle":np.random.choice([-90, 0, 90]),
-"Inhibition":True,
-"Conflict":"Incongruent",
-"Response_Availability":True,
-"Response_Correct":"NA"
-                }
-                if trial["Local_Angle"] in [-90, 0]:
-                    trial["Global_Angle"] = trial["Local_Angle"] + 180
-                else:
-                    trial["Global_Angle"] = trial["Local_Angle"] - 180
-                trials.append(trial)
-            for i in range(3):
-                trial = {
-"Condition_Response_Selection":response_selection,
-"Condition_Inhibition":inhibition,
-"Condition_Conflict":conflict,
-"Global_Shape":"global",
-"Global_Color":"white",
-"Local_Shape":"local",
-"Local_Color":np.random.choice(["red", "yellow", "blue"]),
-"Local_Angle":180,
-"Inhibition":True,
-"Conflict":"Incongruent",
-"Response_Availability":False,
-"Response_Correct":"NA"
-                }
-                if trial["Local_Angle"] in [-90, 0]:
-                    trial["Global_Angle"] = trial["Local_Angle"] + 180
-                else:
-                    trial["Global_Angle"] = trial["Local_Angle"] - 180
-                trials.append(trial)
-            np.random.shuffle(trials)
-            for i in range(40):
-                trial = {
-"Condition_Response_Selection":response_selection,
-"Condition_Inhibition":inhibition,
-"Condition_Conflict":conflict,
-"Global_Shape":"global",
-"Global_Color":np.random.choice(["red", "yellow", "blue"]),
-"Local_Shape":"local",
-"Local_Color":np.random.choice(["red", "yellow", "blue"]),
-"Local_Angle":np.random.choice([-90, 0, 90]),
-"Inhibition":False,
-"Conflict":"Congruent",
-"Response_Availability":True
-                }
-                trial["Response_Correct"] = correct_responses[trial["Local_Angle"]]
-                trial["Global_Angle"] = trial["Local_Angle"]
-                trials.append(trial)
-            for i in range(3):
-                trial = {
-"Condition_Response_Selection":response_selection,
-"Condition_Inhibition":inhibition,
-"Condition_Conflict":conflict,
-"Global_Shape":"global",
-"Global_Color":np.random.choice(["red", "yellow", "blue"]),
-"Local_Shape":"local",
-"Local_Color":np.random.choice(["red", "yellow", "blue"]),
-"Local_Angle":180,
-"Inhibition":False,
-"Conflict":"Congruent",
-"Response_Availability":False,
-"Response_Correct":"NA"
-                }
-                trial["Global_Angle"] = trial["Local_Angle"]
-                trials.append(trial)
-            for i in range(6):
-                trial = {
-"Condition_Response_Selection":response_selection,
-"Condition_Inhibition":inhibition,
-"Condition_Conflict":conflict,
-"Global_Shape":"global",
-"Global_Color":"white",
-"Local_Shape":"local",
-"Local_Color":np.random.choice(["red", "yellow", "blue"]),
-"Local_Angle":np.random.choice([-90, 0, 90]),
-"Inhibition":True,
-"Conflict":"Congruent",
-"Response_Availability":True,
-"Response_Correct":"NA"
-                }
-                trial["Global_Angle"] = trial["Local_Angle"]
-                trials.append(trial)
-            for i in range(3):
-                trial = {
-"Condition_Response_Selection":response_selection,
-"Condition_Inhibition":inhibition,
-"Condition_Conflict":conflict,
-"Global_Shape":"global",
-"Global_Color":"white",
-"Local_Shape":"local",
-"Local_Color":np.random.choice(["red", "yellow", "blue"]),
-"Local_Angle":180,
-"Inhibition":True,
-"Conflict":"Congruent",
-"Response_Availability":False,
-"Response_Correct":"NA"
-                }
-                trial["Global_Angle"] = trial["Local_Angle"]
-                trials.append(trial)
-            np.random.shuffle(trials)
+    phases.mark("Sequence")
+    trials = block_trials(response_selection, inhibition, conflict, rng, pool)
+    # Composite the stimuli of the first trials while the instructions are read, then ahead of each trial
+    cache.prepare(stimuli.trial_stimuli(trials))
 
 
 
     # Instructions
+    phases.mark("Instructions")
     n.newpage("white")
     n.write("Instructions", style="bold", y=8, size=1.5)
 
@@ -478,184 +282,133 @@ def sequence(cache, response_selection="None", inhibition=False, conflict=False)
 
 
     # Run trials
-    data = run_trials(cache, trials)
+    phases.mark("Trials")
+    data = run_trials(cache, trials, log, scorer)
+    if log is not None:
+        log.checkpoint(data)
+    phases.mark("Statistics")
     df = statistics(data)
+    phases.end()
 
     return(df)
 
-
-#==============================================================================
-# Processing
-#==============================================================================
-def processing(dfs):
-    df = pd.concat(dfs)
-
-    # Slice it
-    base = df[(df['Condition_Response_Selection']=='None')].reset_index()
-    base["Order"] = range(1, len(base)+1)
-    respsel = df[(df['Condition_Response_Selection']=='Conditional') & (df['Condition_Inhibition']==False) & (df['Condition_Conflict']==False)].reset_index()
-    respsel["Order"] = range(1, len(respsel)+1)
-    inhib = df[(df['Condition_Response_Selection']=='Conditional') & (df['Condition_Inhibition']==True) & (df['Condition_Conflict']==False)].reset_index()
-    inhib["Order"] = range(1, len(inhib)+1)
-    cong = df[(df['Condition_Response_Selection']=='Conditional') & (df['Condition_Inhibition']==True) & (df['Condition_Conflict']==True) & (df['Conflict']=='Congruent')].reset_index()
-    cong["Order"] = range(1, len(cong)+1)
-    incong = df[(df['Condition_Response_Selection']=='Conditional') & (df['Condition_Inhibition']==True) & (df['Condition_Conflict']==True)  & (df['Conflict']=='Incongruent')].reset_index()
-    incong["Order"] = range(1, len(incong)+1)
-
-
-    # Speed: First computation with outliers
-    rt_base = base[base["Correct"]==1]["RT"].mean()
-    sd_base = base[base["Correct"]==1]["RT"].std()
-    rt_respsel = respsel[(respsel["Correct"]==1) & (respsel["Response_Correct"].isnull()==False)]["RT"].mean()
-    sd_respsel = respsel[(respsel["Correct"]==1) & (respsel["Response_Correct"].isnull()==False)]["RT"].std()
-    rt_inhib = inhib[(inhib["Correct"]==1) & (inhib["Response_Correct"].isnull()==False)]["RT"].mean()
-    sd_inhib = inhib[(inhib["Correct"]==1) & (inhib["Response_Correct"].isnull()==False)]["RT"].std()
-    rt_cong = cong[(cong["Correct"]==1) & (cong["Response_Correct"].isnull()==False)]["RT"].mean()
-    sd_cong = cong[(cong["Correct"]==1) & (cong["Response_Correct"].isnull()==False)]["RT"].std()
-    rt_incong = incong[(incong["Correct"]==1) & (incong["Response_Correct"].isnull()==False)]["RT"].mean()
-    sd_incong = incong[(incong["Correct"]==1) & (incong["Response_Correct"].isnull()==False)]["RT"].std()
-
-    # Outliers detection
-    base["Outliers"] = np.greater((base["RT"]), rt_base+sd_base*1.96) | np.less((base["RT"]), rt_base-sd_base*1.96)
-    respsel["Outliers"] = np.greater((respsel["RT"]), rt_respsel+sd_respsel*1.96) | np.less((respsel["RT"]), rt_respsel-sd_respsel*1.96)
-    inhib["Outliers"] = np.greater((inhib["RT"]), rt_inhib+sd_inhib*1.96) | np.less((inhib["RT"]), rt_inhib-sd_inhib*1.96)
-    cong["Outliers"] = np.greater((cong["RT"]), rt_cong+sd_cong*1.96) | np.less((cong["RT"]), rt_cong-sd_cong*1.96)
-    incong["Outliers"] = np.greater((incong["RT"]), rt_incong+sd_incong*1.96) | np.less((incong["RT"]), rt_incong-sd_incong*1.96)
-
-    # Speed: Second computation without outliers
-    rt_base = base[(base["Correct"]==1) & (base["Outliers"]==False)]["RT"].mean()
-    sd_base = base[(base["Correct"]==1) & (base["Outliers"]==False)]["RT"].std()
-    rt_respsel = respsel[(respsel["Correct"]==1) & (respsel["Response_Correct"].isnull()==False) & (base["Outliers"]==False)]["RT"].mean()
-    sd_respsel = respsel[(respsel["Correct"]==1) & (respsel["Response_Correct"].isnull()==False) & (base["Outliers"]==False)]["RT"].std()
-    rt_inhib = inhib[(inhib["Correct"]==1) & (inhib["Response_Correct"].isnull()==False) & (base["Outliers"]==False)]["RT"].mean()
-    sd_inhib = inhib[(inhib["Correct"]==1) & (inhib["Response_Correct"].isnull()==False) & (base["Outliers"]==False)]["RT"].std()
-    rt_cong = cong[(cong["Correct"]==1) & (cong["Response_Correct"].isnull()==False) & (base["Outliers"]==False)]["RT"].mean()
-    sd_cong = cong[(cong["Correct"]==1) & (cong["Response_Correct"].isnull()==False) & (base["Outliers"]==False)]["RT"].std()
-    rt_incong = incong[(incong["Correct"]==1) & (incong["Response_Correct"].isnull()==False) & (base["Outliers"]==False)]["RT"].mean()
-    sd_incong = incong[(incong["Correct"]==1) & (incong["Response_Correct"].isnull()==False) & (base["Outliers"]==False)]["RT"].std()
-
-    respsel_effect = rt_respsel - rt_base
-    inhibt_effect = rt_inhib - rt_respsel
-    cong_effect = rt_cong - rt_inhib
-    incong_effect = rt_incong - rt_inhib
-
-    df = pd.concat([base, respsel, inhib, cong, incong])
-
-    df["Speed_Core"] = rt_base
-    df["Speed_Core_Variability"] = sd_base
-    df["Speed_Response_Selection_Effect"] = respsel_effect
-    df["Speed_Inhibition_Effect"] = inhibt_effect
-    df["Speed_Congruence_Effect"] = cong_effect
-    df["Speed_Incongruence_Effect"] = incong_effect
-
-
-
-    # Errors
-    base_errors = list(base["Correct"]).count(0)
-    respsel_errors_go = list(respsel[respsel["Response_Availability"]==True]["Correct"]).count(0)
-    respsel_errors_nopos = list(respsel[respsel["Response_Availability"]==False]["Correct"]).count(0)
-
-    neutral_errors_go = list(inhib[(inhib["Response_Availability"]==True) & (inhib["Inhibition"]==False)]["Correct"]).count(0)
-    neutral_errors_nopos = list(inhib[(inhib["Response_Availability"]==False) & (inhib["Inhibition"]==False)]["Correct"]).count(0)
-    neutral_errors_nogo = list(inhib[(inhib["Response_Availability"]==True) & (inhib["Inhibition"]==True)]["Correct"]).count(0)
-    neutral_errors_double = list(inhib[(inhib["Response_Availability"]==False) & (inhib["Inhibition"]==True)]["Correct"]).count(0)
-
-    cong_errors_go = list(cong[(cong["Response_Availability"]==True) & (cong["Inhibition"]==False)]["Correct"]).count(0)
-    cong_errors_nopos = list(cong[(cong["Response_Availability"]==False) & (cong["Inhibition"]==False)]["Correct"]).count(0)
-    cong_errors_nogo = list(cong[(cong["Response_Availability"]==True) & (cong["Inhibition"]==True)]["Correct"]).count(0)
-    cong_errors_double = list(cong[(cong["Response_Availability"]==False) & (cong["Inhibition"]==True)]["Correct"]).count(0)
-
-    incong_errors_go = list(incong[(incong["Response_Availability"]==True) & (incong["Inhibition"]==False)]["Correct"]).count(0)
-    incong_errors_nopos = list(incong[(incong["Response_Availability"]==False) & (incong["Inhibition"]==False)]["Correct"]).count(0)
-    incong_errors_nogo = list(incong[(incong["Response_Availability"]==True) & (incong["Inhibition"]==True)]["Correct"]).count(0)
-    incong_errors_double = list(incong[(incong["Response_Availability"]==False) & (incong["Inhibition"]==True)]["Correct"]).count(0)
-
-    errors_go = list(df[(df["Response_Availability"]==True) & (df["Inhibition"]==False) & (df["Condition_Response_Selection"]!="None")]["Correct"]).count(0)
-    errors_nopos = list(df[(df["Response_Availability"]==False)]["Correct"]).count(0)
-    errors_nogo = list(df[(df["Inhibition"]==True)]["Correct"]).count(0)
-    errors_total = list(df[(df["Condition_Response_Selection"]!="None")]["Correct"]).count(0)
-
-    df["Errors_Total"] = errors_total/len(df)
-
-
-    df["Errors_Orientation"] = errors_go / len(list(df[(df["Response_Availability"]==True) & (df["Inhibition"]==False) & (df["Condition_Response_Selection"]!="None")]["Correct"]))
-
-
-    df["Errors_Response_Selection"] = errors_nopos / len(list(df[(df["Response_Availability"]==False)]["Correct"]))
-
-    df["Errors_Inhibition"] = errors_nogo  / len(list(df[(df["Inhibition"]==True)]["Correct"]))
-
-    # IES: Inverse Efficiency Score
-    IES_Neutral = rt_inhib/(1-neutral_errors_go/len(inhib[(inhib["Response_Availability"]==True) & (inhib["Inhibition"]==False)]))
-    IES_Congruent = rt_cong/(1-cong_errors_go/len(cong[(cong["Response_Availability"]==True) & (cong["Inhibition"]==False)]))
-    IES_Incongruent = rt_incong/(1-incong_errors_go/len(incong[(incong["Response_Availability"]==True) & (incong["Inhibition"]==False)]))
-
-
-    df["IES_Neutral"] = IES_Neutral
-    df["IES_Neutral_log"] = np.log(IES_Neutral)
-    df["IES_Congruent"] = IES_Congruent
-    df["IES_Congruent_log"] = np.log(IES_Congruent)
-    df["IES_Incongruent"] = IES_Incongruent
-    df["IES_Incongruent_log"] = np.log(IES_Incongruent)
-
-
-    df = df.drop('index', axis=1)
-
-
-
-
-    return(df)
 #==============================================================================
 # Procedure
 #==============================================================================
-def procedure():
+def procedure(rng=None, log=None, cache=None):
 
     n.newpage("white")
     n.write("Veuillez patienter...", y=-9, color="blue")
     n.refresh()
 
-    # Preload images in cache
-    cache = {}
-    for colour in ["white", "red", "yellow", "blue", "black"]:
-        for focus in ["global", "local"]:
-            for angle in [-90, 0, 90, 180]:
-                cache = n.preload(colour + "_" + focus, size=8, extension = ".png", cache = cache, path = "./Stimuli/", rotate=angle)
-                cache = n.preload(colour + "_circle", size=8, extension = ".png", cache = cache, path = "./Stimuli/", rotate=angle)
-
+    # Stimuli are composited ahead of the trials (from the atlas of the station if built)
+    phases = tracing.steps("Procedure")
+    phases.mark("Preload")
+    own_cache = cache is None
+    if own_cache is True:
+        cache = stimuli.StimulusCache(n, atlas=stimuli.load_atlas(n.screen_height))
+
+    rng = np.random.default_rng(rng)
+    pool = schedules.load_pool() if constrained_sequences is True else None
+    # Session scores, updated after each trial
+    scorer = scoring.OnlineScorer()
     dfs = []
-    dfs.append(sequence(cache, response_selection="None", inhibition=False, conflict=False))
-    dfs.append(sequence(cache, response_selection="Conditional", inhibition=False, conflict=False))
-    dfs.append(sequence(cache, response_selection="Conditional", inhibition=True, conflict=False))
-    dfs.append(sequence(cache, response_selection="Conditional", inhibition=True, conflict=True))
-
-    df = processing(dfs)
+    phases.mark("Blocks")
+    try:
+        dfs.append(sequence(cache, response_selection="None", inhibition=False, conflict=False, rng=rng, log=log, scorer=scorer, pool=pool))
+        dfs.append(sequence(cache, response_selection="Conditional", inhibition=False, conflict=False, rng=rng, log=log, scorer=scorer, pool=pool))
+        dfs.append(sequence(cache, response_selection="Conditional", inhibition=True, conflict=False, rng=rng, log=log, scorer=scorer, pool=pool))
+        dfs.append(sequence(cache, response_selection="Conditional", inhibition=True, conflict=True, rng=rng, log=log, scorer=scorer, pool=pool))
+    finally:
+        if own_cache is True:
+            cache.close()
+
+    phases.mark("Processing")
+    df = scoring.processing(dfs, scorer)
+    phases.end()
     return(df)
+
+
+
 #==============================================================================
 # Run
 #==============================================================================
-n.start()
-n.start_screen(name="CoCon", authors=authors)
+def main(display=None):
+    # Importing neuropsydia opens the task window
+    global n
+    if data_format != "csv":
+        storage.check_format(data_format)
+    if display is None:
+        import neuropsydia as display
+    n = display
+    if trace is True:
+        tracing.start()
+    phases = tracing.steps("Session")
+    phases.mark("Start")
 
-experiment_start = datetime.datetime.now()
+    n.start()
+    n.start_screen(name="CoCon", authors=authors)
 
+    experiment_start = datetime.datetime.now()
 
 
-# Participant info
-n.newpage()
-participant_id = n.ask("Participant ID: ")
 
+    # Participant info
+    n.newpage()
+    participant_id = n.ask("Participant ID: ")
 
 
-df = procedure()
 
-# Save data
-df["Participant_ID"] = participant_id
-df["Experiment_Start"] = experiment_start
-df["Experiment_End"] = datetime.datetime.now()
-df["Version"] = version
-df["Experiment_Duration"] = (datetime.datetime.now()-experiment_start).total_seconds()
+    # Trials are logged as they run (see triallog.py to recover an interrupted session)
+    log = triallog.TrialLog("./Data/Log/" + participant_id + "_" + experiment_start.strftime("%Y-%m-%d_%H-%M-%S"),
+                            session={"Participant_ID": participant_id, "Experiment_Start": experiment_start, "Version": version})
+    cache = stimuli.StimulusCache(n, atlas=stimuli.load_atlas(n.screen_height))
+    uploading = None
+
+    # The screen, the cache and the trace are released even if the task is aborted (ESCAPE)
+    try:
+        phases.mark("Run")
+        try:
+            if seed is None:
+                df = procedure(log=log, cache=cache)
+            else:
+                df = procedure(sequences.participant_rng(participant_id, seed), log=log, cache=cache)
+        finally:
+            log.close()
+            cache.close()
+
+        # Save data
+        phases.mark("Save")
+        df["Participant_ID"] = participant_id
+        df["Experiment_Start"] = experiment_start
+        df["Experiment_End"] = datetime.datetime.now()
+        df["Version"] = version
+        df["Experiment_Duration"] = (datetime.datetime.now()-experiment_start).total_seconds()
+
+        if data_format == "csv":
+            n.save_data(df, filename="CoCon", path="./Data/", participant_id=participant_id, index=False)
+        else:
+            storage.save_session(df, path="./Data/", data_format=data_format)
+        n.save_data(timing.jitter_summary(df), filename="CoCon_Timing", path="./Data/Timing/", participant_id=participant_id, index=False)
+        if cohort_path is not None:
+            cohort.Cohort(cohort_path, mode="a").add(df)
+        if collector_address is not None:
+            # Sent while the end screen is shown
+            uploading = collector.upload_thread(df, collector_address)
+
+        phases.mark("End")
+        n.end_screen(name="CoCon", authors=authors)
+    finally:
+        n.close()
+        if uploading is not None:
+            phases.mark("Upload")
+            uploading.join(upload_wait)
+            if uploading.is_alive():
+                print("CoCon: the session was not acknowledged by the collector, send it again with collector.py send.")
+        phases.end()
+        tracing.stop("./Data/Traces/" + participant_id + "_" + experiment_start.strftime("%Y-%m-%d_%H-%M-%S") + ".json")
+    return(df)
 
-n.save_data(df, filename="CoCon", path="./Data/", participant_id=participant_id, index=False)
 
-n.end_screen(name="CoCon", authors=authors)
-n.close()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
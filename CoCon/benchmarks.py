@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+"""
+Cognitive Control Task: benchmarks of the sequences, the scoring and the stimuli.
+Authors: Makowski et al. (under review)
+Copyright: The Neuropsydia Development Team
+Site: https://github.com/DominiqueMakowski/CoCon.py
+
+Usage: python benchmarks.py [--output benchmarks.json] [--scales 1 10 100] [--compare previous.json]
+
+Each benchmark is timed over a few repeats (best, median), and run once more for its memory
+high-water mark: under tracemalloc, or for the stimuli (pygame surfaces are out of its sight), as
+the growth of the resident memory of the process. Where the resident memory cannot be read (neither
+/proc nor psutil), the memory of the stimuli benchmarks is not measured.
+"""
+
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import subprocess
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import headless
+import schedules
+import scoring
+import sequences
+import simulation
+import stimuli
+
+#==============================================================================
+# Initialization
+#==============================================================================
+scales = [1, 10, 100]
+cohorts = [100, 1000, 10000]
+repeats = 5
+
+
+#==============================================================================
+# Measure
+#==============================================================================
+def resident_memory():
+    """
+    Resident memory of the process (bytes), or None where it cannot be read.
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            return(int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE"))
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import psutil
+    except ImportError:
+        return(None)
+    return(psutil.Process().memory_info().rss)
+
+
+
+def peak_resident(function, interval=0.001):
+    """
+    Growth of the resident memory (bytes) while function() runs, at its highest (sampled every
+    interval, in s), or None where it cannot be read.
+    """
+    gc.collect()
+    start = resident_memory()
+    if start is None:
+        function()
+        return(None)
+    peak = [start]
+    running = threading.Event()
+    running.set()
+
+    def sample():
+        while running.is_set():
+            peak[0] = max(peak[0], resident_memory())
+            time.sleep(interval)
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    try:
+        function()
+    finally:
+        running.clear()
+        sampler.join()
+    return(max(peak[0], resident_memory()) - start)
+
+
+
+def measure(function, repeats=repeats, setup=None, memory="python"):
+    """
+    Run time (s) of function() over repeats, and the peak memory (bytes) it allocates: in Python
+    objects and numpy arrays (tracemalloc), or in the resident memory of the process ("rss", which
+    also sees the memory of pygame and SDL; None if it cannot be read). setup() prepares its
+    argument, outside of the measures.
+    """
+    times = []
+    for repeat in range(repeats):
+        argument = setup() if setup is not None else None
+        start = time.perf_counter()
+        function(argument) if setup is not None else function()
+        times.append(time.perf_counter() - start)
+
+    argument = setup() if setup is not None else None
+    if memory == "rss":
+        peak = peak_resident(lambda: function(argument) if setup is not None else function())
+    else:
+        tracemalloc.start()
+        function(argument) if setup is not None else function()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return({"repeats": repeats, "best": min(times), "median": float(np.median(times)), "mean": float(np.mean(times)),
+            "peak_memory": peak, "memory": memory})
+
+
+
+def scaled_table(table, scale):
+    """
+    A block as long as scale blocks: the rows of a table of scale sequences, laid end to end.
+    """
+    scaled = {}
+    for column, values in table.items():
+        scaled[column] = values.reshape(1, -1) if isinstance(values, np.ndarray) else values
+    scaled["Order"] = np.arange(1, scaled["Local_Angle"].shape[1]+1).reshape(1, -1)
+    return(scaled)
+
+
+
+#==============================================================================
+# Benchmarks
+#==============================================================================
+def bench_sequences(scales=scales, repeats=repeats):
+    results = []
+    for scale in scales:
+        for number, block in enumerate(sequences.blocks):
+            rng = np.random.default_rng(0)
+            result = measure(lambda: sequences.sequence_table(block, scale, rng), repeats)
+            results.append(dict(result, name="sequence_table", block=number+1, scale=scale))
+            result = measure(lambda: schedules.constrained_table(block, scale, rng), repeats)
+            results.append(dict(result, name="constrained_table", block=number+1, scale=scale))
+    results.append(dict(measure(lambda: sequences.trial_store("Conditional", True, True), repeats), name="trial_store", block=4, scale=1))
+    return(results)
+
+
+
+def bench_scoring(scales=scales, repeats=repeats):
+    results = []
+    for scale in scales:
+        tables = [scaled_table(table, scale) for table in simulation.simulate(scale, seed=0)]
+        frames = [sequences.trial_frame(table) for table in tables]
+        for number, frame in enumerate(frames):
+            result = measure(lambda: scoring.statistics(frame), repeats)
+            results.append(dict(result, name="statistics", block=number+1, scale=scale, trials=len(frame)))
+        dfs = [scoring.statistics(frame) for frame in frames]
+        result = measure(lambda: scoring.processing(dfs), repeats)
+        results.append(dict(result, name="processing", scale=scale, trials=sum(len(df) for df in dfs)))
+    return(results)
+
+
+
+def bench_cohorts(cohorts=cohorts, repeats=repeats):
+    results = []
+    for participants in cohorts:
+        tables = simulation.simulate(participants, seed=0)
+        result = measure(lambda: simulation.simulated_scores(tables), repeats)
+        results.append(dict(result, name="array_scores", participants=participants))
+    tables = simulation.simulate(10, seed=0)
+    result = measure(lambda: [scoring.processing(simulation.simulated_session(tables, participant)) for participant in range(10)], repeats)
+    results.append(dict(result, name="processing_sessions", participants=10))
+    return(results)
+
+
+
+def bench_stimuli(repeats=repeats):
+    """
+    Preload, composite and draw under the headless display (rendering for real, off-screen).
+    """
+    results = []
+    display = headless.Display(render=True)
+    display.start()
+    variants = stimuli.atlas_variants()
+
+    def preload(cache):
+        for file, rotate, size in variants:
+            display.preload(file, size=size, extension=".png", cache=cache, path=stimuli.stimuli_path, rotate=rotate)
+    results.append(dict(measure(preload, repeats, setup=dict, memory="rss"), name="preload", stimuli=len(variants)))
+
+    trials = sequences.trial_store("Conditional", True, True, rng=0)
+    trial_stimuli = stimuli.trial_stimuli(trials)
+
+    def prepare(atlas=None):
+        cache = stimuli.StimulusCache(display, atlas=atlas)
+        for future in cache.prepare(trial_stimuli):
+            future.result()
+        return(cache)
+    composites = len(set(tuple(stimuli_list) for stimuli_list in trial_stimuli))
+    results.append(dict(measure(lambda: prepare().close(), repeats, memory="rss"), name="compose_block", stimuli=composites))
+    # From the atlas of the screen, if it is built
+    atlas = stimuli.load_atlas(display.screen_height)
+    if atlas is not None:
+        results.append(dict(measure(lambda: prepare(atlas).close(), repeats, memory="rss"), name="compose_block_atlas", stimuli=composites))
+
+    cache = prepare(atlas)
+    names = [cache.compose(stimuli_list) for stimuli_list in trial_stimuli]
+
+    def draw():
+        for name in names:
+            display.image(name, size=stimuli.stimuli_size, extension=".png", cache=cache, path=stimuli.stimuli_path)
+            display.refresh()
+    results.append(dict(measure(draw, repeats, memory="rss"), name="draw", trials=len(names)))
+    cache.close()
+    return(results)
+
+
+
+#==============================================================================
+# Report
+#==============================================================================
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return({"commit": commit, "date": datetime.datetime.now().isoformat(), "python": platform.python_version(),
+            "numpy": np.__version__, "pandas": pd.__version__, "platform": platform.platform()})
+
+
+
+def run(scales=scales, cohorts=cohorts, repeats=repeats, render=True):
+    results = bench_sequences(scales, repeats) + bench_scoring(scales, repeats) + bench_cohorts(cohorts, repeats)
+    if render is True:
+        results += bench_stimuli(repeats)
+    return({"environment": environment(), "results": results})
+
+
+
+def label(result):
+    return(" ".join([result["name"]] + [key + "=" + str(result[key]) for key in ["block", "scale", "participants", "stimuli"] if key in result]))
+
+
+
+def compare(report, previous):
+    """
+    Ratio of the median times (and peak memory) of a report to those of a previous one. Memory is
+    only compared if measured the same way in both.
+    """
+    before = {label(result): result for result in previous["results"]}
+    rows = []
+    for result in report["results"]:
+        if label(result) in before:
+            old = before[label(result)]
+            comparable = result["peak_memory"] is not None and old["peak_memory"] is not None and result.get("memory", "python") == old.get("memory", "python")
+            rows.append({"Benchmark": label(result),
+                         "Time_Ratio": result["median"] / old["median"],
+                         "Memory_Ratio": result["peak_memory"] / max(old["peak_memory"], 1) if comparable else np.nan})
+    return(pd.DataFrame(rows))
+
+
+
+#==============================================================================
+# Run
+#==============================================================================
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Benchmark the CoCon sequences, scoring and stimuli.")
+    parser.add_argument("--output", default="benchmarks.json", help="JSON report to write.")
+    parser.add_argument("--scales", type=int, nargs="+", default=scales, help="Block lengths, in number of blocks.")
+    parser.add_argument("--cohorts", type=int, nargs="+", default=cohorts, help="Cohort sizes, in participants.")
+    parser.add_argument("--repeats", type=int, default=repeats, help="Timed runs of each benchmark.")
+    parser.add_argument("--no-render", action="store_true", help="Skip the stimuli benchmarks.")
+    parser.add_argument("--compare", default=None, help="Previous JSON report to compare with.")
+    args = parser.parse_args(args)
+
+    report = run(args.scales, args.cohorts, args.repeats, render=not args.no_render)
+    with open(args.output, "w") as output:
+        json.dump(report, output, indent=2)
+    for result in report["results"]:
+        memory = "not measured" if result["peak_memory"] is None else "{:.1f} MB".format(result["peak_memory"]/1024**2) + (" (RSS)" if result["memory"] == "rss" else "")
+        print("{:<50} {:>10.2f} ms {:>18}".format(label(result), result["median"]*1000, memory))
+    if args.compare is not None:
+        with open(args.compare) as previous:
+            print(compare(report, json.load(previous)).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+Cognitive Control Task: bootstrap standard errors and confidence intervals of the session scores.
+Authors: Makowski et al. (under review)
+Copyright: The Neuropsydia Development Team
+Site: https://github.com/DominiqueMakowski/CoCon.py
+
+Usage: python bootstrap.py CoCon_cohort.csv [--resamples 2000] [--output CoCon_bootstrap.csv] [--jobs N]
+"""
+
+import argparse
+import concurrent.futures
+import os
+
+import numpy as np
+import pandas as pd
+
+import scoring
+
+#==============================================================================
+# Initialization
+#==============================================================================
+resamples = 2000
+alpha = 0.05
+# Resamples scored at once, to bound memory
+chunk_size = 500
+# Column identifying the sessions of a cohort table (see rescore.py)
+session_column = "File"
+
+
+#==============================================================================
+# Bootstrap
+#==============================================================================
+def session_arrays(df):
+    """
+    The trials of a processed session as the arrays of scoring.array_scores() (one row).
+    """
+    correct = (df["Correct"]==1).values
+    arrays = {"rt": df["RT"].values.astype(float),
+              "correct": correct,
+              "condition": scoring.condition_key(df).codes,
+              "trial_type": scoring.trial_type(df).codes,
+              "scored": correct & df["Response_Correct"].notnull().values}
+    return({name: values[None, :] for name, values in arrays.items()})
+
+
+
+def resample_indices(strata, n=resamples, rng=None):
+    """
+    Index matrix of shape (n, trials) drawing each trial with replacement among the trials of its stratum.
+    """
+    rng = np.random.default_rng(rng)
+    order = np.argsort(strata, kind="stable")
+    _, start, size = np.unique(strata[order], return_index=True, return_counts=True)
+    # Start and size of the stratum of each (sorted) trial
+    position = np.repeat(start, size)
+    length = np.repeat(size, size)
+    draws = position + (rng.random((n, len(strata))) * length).astype(np.intp)
+    indices = np.empty(draws.shape, dtype=np.intp)
+    indices[:, order] = order[draws]
+    return(indices)
+
+
+
+def bootstrap_session(arrays, n=resamples, alpha=alpha, rng=None):
+    """
+    Scores of a session (see session_arrays()) with their bootstrap SE and percentile CI. Trials are
+    resampled within each scoring condition and trial type, so that the design of the session is kept.
+    """
+    rng = np.random.default_rng(rng)
+    estimate = scoring.array_scores(**arrays).iloc[0]
+
+    strata = arrays["condition"][0].astype(int) * len(scoring.trial_types) + arrays["trial_type"][0]
+    samples = []
+    for start in range(0, n, chunk_size):
+        indices = resample_indices(strata, min(chunk_size, n-start), rng)
+        samples.append(scoring.array_scores(**{name: values[0][indices] for name, values in arrays.items()}))
+    samples = pd.concat(samples, ignore_index=True).replace([np.inf, -np.inf], np.nan)
+
+    return(pd.DataFrame({"Estimate": estimate,
+                         "SE": samples.std(),
+                         "CI_Low": samples.quantile(alpha/2),
+                         "CI_High": samples.quantile(1-alpha/2)}))
+
+
+
+def bootstrap_row(arrays, n=resamples, alpha=alpha, rng=None):
+    """
+    bootstrap_session() as a single row: <score>, <score>_SE, <score>_CI_Low and <score>_CI_High.
+    """
+    result = bootstrap_session(arrays, n, alpha, rng)
+    row = {}
+    for score in result.index:
+        row[score] = result["Estimate"][score]
+        for column in ["SE", "CI_Low", "CI_High"]:
+            row[score + "_" + column] = result[column][score]
+    return(row)
+
+
+
+def bootstrap_cohort(df, by=session_column, n=resamples, alpha=alpha, seed=None, jobs=1):
+    """
+    Bootstrap every session of a cohort table (e.g., from rescore.py), sharded over jobs processes.
+    Each session draws from its own stream of the seed, so results do not depend on jobs.
+    """
+    groups = [(key, session_arrays(session)) for key, session in df.groupby(by, sort=True)]
+    rngs = [np.random.default_rng(stream) for stream in np.random.SeedSequence(seed).spawn(len(groups))]
+
+    if jobs == 1:
+        rows = [bootstrap_row(arrays, n, alpha, rng) for (key, arrays), rng in zip(groups, rngs)]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+            rows = list(executor.map(bootstrap_row, [arrays for key, arrays in groups], [n]*len(groups), [alpha]*len(groups), rngs))
+
+    results = pd.DataFrame(rows)
+    results.insert(0, by, [key for key, arrays in groups])
+    return(results)
+
+
+
+#==============================================================================
+# Run
+#==============================================================================
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Bootstrap the scores of every session of a CoCon cohort table.")
+    parser.add_argument("cohort", help="Cohort table (see rescore.py).")
+    parser.add_argument("--by", default=session_column, help="Column identifying the sessions.")
+    parser.add_argument("--resamples", type=int, default=resamples, help="Number of bootstrap resamples.")
+    parser.add_argument("--alpha", type=float, default=alpha, help="Confidence intervals cover 1-alpha.")
+    parser.add_argument("--seed", type=int, default=None, help="Seed, for reproducible intervals.")
+    parser.add_argument("--output", default="CoCon_bootstrap.csv", help="Table to write.")
+    parser.add_argument("--jobs", type=int, default=None, help="Number of processes (default: number of cores).")
+    args = parser.parse_args(args)
+
+    # "None" is a condition, not a missing value
+    df = pd.read_csv(args.cohort, keep_default_na=False, na_values=[""])
+    results = bootstrap_cohort(df, by=args.by, n=args.resamples, alpha=args.alpha, seed=args.seed, jobs=args.jobs or os.cpu_count() or 1)
+    results.to_csv(args.output, index=False)
+    print("CoCon: " + str(len(results)) + " sessions bootstrapped into " + args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,417 @@
+# -*- coding: utf-8 -*-
+"""
+Cognitive Control Task: cohort store, for queries across all the saved sessions.
+Authors: Makowski et al. (under review)
+Copyright: The Neuropsydia Development Team
+Site: https://github.com/DominiqueMakowski/CoCon.py
+
+Usage: python cohort.py ingest ./Data/*.csv [--store ./Data/Cohort/]
+       python cohort.py query RT --where Conflict=Incongruent Version=1.0 [--store ./Data/Cohort/]
+
+The trials and the sessions of a cohort are kept as one file per column, of fixed-width values
+mapped in memory. New sessions are appended at the end of the files: the rows already stored are
+never rewritten. Integer columns are stored as integers, and text columns (IDs included, even when
+they look like numbers) as codes into their levels. The indexes hold, for each value of the indexed
+columns, the ranges of trials that have it, so that a query only slices the columns (views of the
+mapped files, without copies). A session counts once cohort.json lists it, so a session interrupted
+while being added is overwritten by the next one. Add sessions from one process at a time.
+"""
+
+import argparse
+import glob
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+import storage
+
+#==============================================================================
+# Initialization
+#==============================================================================
+store_path = "./Data/Cohort/"
+# Columns whose values are indexed (all text columns, stored as codes)
+index_columns = ["Participant_ID", "Version", "Condition_Response_Selection", "Condition_Inhibition", "Condition_Conflict", "Conflict"]
+date_columns = ["Time_Trial_Onset", "Time_Stimulus_Onset", "Experiment_Start", "Experiment_End"]
+# Value of the missing values of each stored type (booleans are stored as int8, integers as int64, text as int32 codes)
+missing = {"float64": np.nan, "int8": -1, "int32": -1, "int64": np.iinfo(np.int64).min, "datetime64[ns]": np.datetime64("NaT", "ns")}
+
+
+#==============================================================================
+# Columns
+#==============================================================================
+def column_spec(name, values):
+    """
+    How a column is stored, from its first values.
+    """
+    if name in index_columns:
+        return({"dtype": "int32", "levels": []})
+    if name in date_columns:
+        return({"dtype": "datetime64[ns]"})
+    if pd.api.types.is_bool_dtype(values):
+        return({"dtype": "int8"})
+    if pd.api.types.is_integer_dtype(values):
+        return({"dtype": "int64"})
+    if pd.api.types.is_numeric_dtype(values):
+        return({"dtype": "float64"})
+    return({"dtype": "int32", "levels": []})
+
+
+
+def encode(spec, values):
+    """
+    Values as stored (new levels are added to the spec).
+    """
+    values = pd.Series(values).reset_index(drop=True)
+    absent = values.isna().values
+    if "levels" in spec:
+        text = np.asarray(values.astype(object).values, dtype=str)
+        uniques, inverse = np.unique(np.where(absent, "", text), return_inverse=True)
+        codes = {level: code for code, level in enumerate(spec["levels"])}
+        for level in uniques[np.isin(uniques, text[~absent])]:
+            if level not in codes:
+                codes[level] = len(spec["levels"])
+                spec["levels"].append(str(level))
+        lookup = np.array([codes.get(level, -1) for level in uniques], dtype=np.int32)
+        return(np.where(absent, -1, lookup[inverse]).astype(np.int32))
+    if spec["dtype"] == "datetime64[ns]":
+        return(pd.to_datetime(values).values.astype("datetime64[ns]"))
+    if spec["dtype"] == "int8":
+        if pd.api.types.is_bool_dtype(values):
+            return(values.values.astype(np.int8))
+        flags = values.map({True: 1, False: 0, "True": 1, "False": 0})
+        return(flags.fillna(-1).values.astype(np.int8))
+    numbers = pd.to_numeric(values, errors="coerce")
+    if spec["dtype"] == "int64":
+        absent = numbers.isna().values
+        if np.any(numbers.values[~absent] % 1 != 0):
+            raise ValueError("CoCon: non-integer values for a column stored as integers (see column_spec()).")
+        return(numbers.fillna(missing["int64"]).values.astype(np.int64))
+    return(numbers.values.astype(spec["dtype"]))
+
+
+
+class Table():
+    """
+    Columns of a table, each appended to its own file and mapped in memory.
+    """
+    def __init__(self, path, meta):
+        self.path = path
+        self.meta = meta
+        self.rows = meta["rows"]
+        self.maps = {}
+
+    def filename(self, name):
+        return(os.path.join(self.path, name + ".bin"))
+
+    def column(self, name):
+        """
+        A column over all the committed rows, as a read-only view of its file.
+        """
+        if name not in self.maps:
+            dtype = np.dtype(self.meta["columns"][name]["dtype"])
+            if self.meta["rows"] == 0:
+                self.maps[name] = np.empty(0, dtype=dtype)
+            else:
+                self.maps[name] = np.asarray(np.memmap(self.filename(name), dtype=dtype, mode="r", shape=(self.meta["rows"],)))
+        return(self.maps[name])
+
+    def truncate(self):
+        """
+        Drop what was written after the last commit (e.g., by an interrupted append).
+        """
+        for name, spec in self.meta["columns"].items():
+            if os.path.exists(self.filename(name)):
+                os.truncate(self.filename(name), self.meta["rows"] * np.dtype(spec["dtype"]).itemsize)
+
+    def append(self, frame):
+        """
+        Write the rows of a DataFrame after the last ones (committed along with cohort.json).
+        """
+        for name in frame.columns:
+            if name not in self.meta["columns"]:
+                # A new column, missing from the rows already stored
+                self.meta["columns"][name] = column_spec(name, frame[name])
+                spec = self.meta["columns"][name]
+                with open(self.filename(name), "wb") as file:
+                    file.write(np.full(self.rows, missing[spec["dtype"]], dtype=spec["dtype"]).tobytes())
+        for name, spec in self.meta["columns"].items():
+            if name in frame.columns:
+                values = encode(spec, frame[name])
+            else:
+                values = np.full(len(frame), missing[spec["dtype"]], dtype=spec["dtype"])
+            with open(self.filename(name), "ab") as file:
+                file.write(np.ascontiguousarray(values).tobytes())
+        self.rows += len(frame)
+
+    def sync(self):
+        for name in self.meta["columns"]:
+            with open(self.filename(name), "rb+") as file:
+                os.fsync(file.fileno())
+        self.meta["rows"] = self.rows
+        self.maps = {}
+
+
+
+#==============================================================================
+# Ranges
+#==============================================================================
+def runs(codes, offset=0):
+    """
+    (code, start, stop) of each run of identical codes, as rows offset by offset.
+    """
+    change = np.flatnonzero(codes[1:] != codes[:-1]) + 1
+    starts = np.concatenate([[0], change])
+    stops = np.concatenate([change, [len(codes)]])
+    return(np.stack([codes[starts], starts + offset, stops + offset], axis=1).astype(np.int64))
+
+
+
+def intersect(range_lists):
+    """
+    Ranges [start, stop) covered by every list of disjoint ranges.
+    """
+    positions = np.concatenate([ranges[:, column] for ranges in range_lists for column in [0, 1]])
+    steps = np.concatenate([np.full(len(ranges), step) for ranges in range_lists for step in [1, -1]])
+    # At the same row, ranges end before others start
+    order = np.lexsort((steps, positions))
+    positions = positions[order]
+    inside = np.flatnonzero(np.cumsum(steps[order]) == len(range_lists))
+    starts, stops = positions[inside], positions[inside + 1]
+    keep = stops > starts
+    starts, stops = starts[keep], stops[keep]
+    if len(starts) == 0:
+        return(np.empty((0, 2), dtype=np.int64))
+    # Merge adjacent ranges
+    first = np.concatenate([[True], starts[1:] != stops[:-1]])
+    last = np.concatenate([starts[1:] != stops[:-1], [True]])
+    return(np.stack([starts[first], stops[last]], axis=1))
+
+
+
+#==============================================================================
+# Cohort
+#==============================================================================
+class Cohort():
+    """
+    The store of a cohort (created if need be). Use mode "a" to add sessions.
+    """
+    def __init__(self, path=store_path, mode="r"):
+        self.path = path
+        self.mode = mode
+        if os.path.exists(os.path.join(path, "cohort.json")):
+            with open(os.path.join(path, "cohort.json")) as file:
+                self.meta = json.load(file)
+        elif mode == "a":
+            self.meta = {"trials": {"rows": 0, "columns": {}}, "sessions": {"rows": 0, "columns": {}},
+                         "index": {column: 0 for column in index_columns}, "keys": []}
+        else:
+            raise ValueError("CoCon: no cohort store in " + path + ".")
+        self.keys = set(self.meta["keys"])
+        self.trials = Table(os.path.join(path, "trials"), self.meta["trials"])
+        self.sessions = Table(os.path.join(path, "sessions"), self.meta["sessions"])
+        self.maps = {}
+        if mode == "a":
+            for folder in ["trials", "sessions", "index"]:
+                if os.path.exists(os.path.join(path, folder)) is False:
+                    os.makedirs(os.path.join(path, folder))
+            self.trials.truncate()
+            self.sessions.truncate()
+            for column, count in self.meta["index"].items():
+                if os.path.exists(self.index_filename(column)):
+                    os.truncate(self.index_filename(column), count * 3 * 8)
+
+    def index_filename(self, column):
+        return(os.path.join(self.path, "index", column + ".bin"))
+
+    # Sessions
+    # --------
+    def add(self, df, commit=True):
+        """
+        Append a processed session (e.g., as saved by CoCon.py). Returns False if it is already stored.
+        """
+        if self.mode != "a":
+            raise ValueError("CoCon: the cohort store is open for reading only.")
+        key = str(df["Participant_ID"].iloc[0]) + "_" + str(pd.to_datetime(df["Experiment_Start"].iloc[0]))
+        if key in self.keys:
+            return(False)
+        session_columns = [column for column in storage.session_columns + storage.score_columns if column in df.columns]
+        summary = df[session_columns].iloc[[0]].reset_index(drop=True)
+        summary["First_Row"] = self.trials.rows
+        summary["Rows"] = len(df)
+        trials = df.drop(columns=session_columns).reset_index(drop=True)
+
+        first = self.trials.rows
+        self.trials.append(trials)
+        self.sessions.append(summary)
+        for column in index_columns:
+            if column in trials.columns:
+                codes = encode(self.trials.meta["columns"][column], trials[column])
+            elif column in summary.columns:
+                codes = np.repeat(encode(self.sessions.meta["columns"][column], summary[column]), len(df))
+            else:
+                continue
+            with open(self.index_filename(column), "ab") as file:
+                file.write(runs(codes, first).tobytes())
+        self.keys.add(key)
+        self.meta["keys"].append(key)
+        if commit is True:
+            self.commit()
+        return(True)
+
+    def commit(self):
+        """
+        Make the sessions added so far part of the store.
+        """
+        self.trials.sync()
+        self.sessions.sync()
+        for column in index_columns:
+            if os.path.exists(self.index_filename(column)):
+                with open(self.index_filename(column), "rb+") as file:
+                    os.fsync(file.fileno())
+                self.meta["index"][column] = os.path.getsize(self.index_filename(column)) // (3 * 8)
+        with open(os.path.join(self.path, "cohort.json.tmp"), "w") as file:
+            json.dump(self.meta, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(os.path.join(self.path, "cohort.json.tmp"), os.path.join(self.path, "cohort.json"))
+        self.maps = {}
+
+    # Queries
+    # -------
+    def index(self, column):
+        """
+        The (code, start, stop) ranges of an indexed column.
+        """
+        if column not in self.maps:
+            count = self.meta["index"].get(column, 0)
+            if count == 0:
+                self.maps[column] = np.empty((0, 3), dtype=np.int64)
+            else:
+                self.maps[column] = np.asarray(np.memmap(self.index_filename(column), dtype=np.int64, mode="r", shape=(count, 3)))
+        return(self.maps[column])
+
+    def levels(self, column):
+        for table in [self.trials, self.sessions]:
+            if column in table.meta["columns"]:
+                return(table.meta["columns"][column].get("levels"))
+        raise ValueError("CoCon: no column " + column + " in the cohort store.")
+
+    def ranges(self, **where):
+        """
+        The ranges [start, stop) of the trials with these values (a value, or a list of values, of
+        indexed columns), e.g., ranges(Conflict="Incongruent", Version="1.0").
+        """
+        range_lists = []
+        for column, values in where.items():
+            if column not in index_columns:
+                raise ValueError("CoCon: " + column + " is not indexed (see cohort.index_columns).")
+            if isinstance(values, (list, tuple, set)) is False:
+                values = [values]
+            levels = self.levels(column) if self.meta["index"].get(column, 0) > 0 else []
+            codes = [levels.index(str(value)) for value in values if str(value) in levels]
+            index = self.index(column)
+            selected = index[np.isin(index[:, 0], codes)][:, 1:]
+            range_lists.append(selected[np.argsort(selected[:, 0], kind="stable")])
+        if len(range_lists) == 0:
+            return(np.array([[0, self.meta["trials"]["rows"]]], dtype=np.int64))
+        return(intersect(range_lists))
+
+    def select(self, columns, **where):
+        """
+        Columns of the trials with these values (see ranges()), as lists of views of the store (one
+        per range of trials, without copies). Text columns hold codes into levels().
+        """
+        ranges = self.ranges(**where)
+        return({column: [self.trials.column(column)[start:stop] for start, stop in ranges] for column in columns})
+
+    def values(self, column, **where):
+        """
+        A column of the trials with these values, in a single array (a copy, unless it is a single range).
+        """
+        views = self.select([column], **where)[column]
+        if len(views) == 1:
+            return(views[0])
+        if len(views) == 0:
+            return(self.trials.column(column)[0:0])
+        return(np.concatenate(views))
+
+    def decode(self, column, codes):
+        levels = np.array(self.levels(column) + [None], dtype=object)
+        return(levels[codes])
+
+    def session_table(self):
+        """
+        The sessions (one row each, with their First_Row and Rows of trials), as a DataFrame.
+        """
+        columns = {}
+        for column, spec in self.sessions.meta["columns"].items():
+            values = self.sessions.column(column)
+            columns[column] = self.decode(column, values) if "levels" in spec else values
+        return(pd.DataFrame(columns))
+
+
+
+#==============================================================================
+# Files
+#==============================================================================
+def read_session(filename):
+    """
+    A saved session: a CSV file, or a columnar file of ./Data/Sessions/ (see storage.py).
+    """
+    if filename.endswith(".csv"):
+        # "None" is a condition, not a missing value, and IDs are text (e.g., "007", or version "1.10")
+        return(pd.read_csv(filename, keep_default_na=False, na_values=[""], float_precision="round_trip",
+                           dtype={column: str for column in index_columns}))
+    summary = storage.read_table(filename)
+    trials = storage.read_table(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(filename))), "Trials", os.path.basename(filename)))
+    for column in summary.columns:
+        if column not in trials.columns:
+            trials[column] = summary[column].iloc[0]
+    return(trials)
+
+
+
+def ingest(files, path=store_path):
+    """
+    Add the sessions of files (not stored yet) to the store. Returns how many were added.
+    """
+    store = Cohort(path, mode="a")
+    added = 0
+    for filename in files:
+        added += store.add(read_session(filename), commit=False)
+    store.commit()
+    return(added)
+
+
+
+#==============================================================================
+# Run
+#==============================================================================
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Add saved CoCon sessions to a cohort store, or query it.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    adding = commands.add_parser("ingest", help="Add saved sessions to the store.")
+    adding.add_argument("files", nargs="+", help="Saved sessions (CSV, or files of ./Data/Sessions/).")
+    adding.add_argument("--store", default=store_path, help="Folder of the store.")
+    query = commands.add_parser("query", help="Summarize a column over the trials with given values.")
+    query.add_argument("column", help="Column to summarize (e.g., RT).")
+    query.add_argument("--where", nargs="*", default=[], help="Values of indexed columns, as Column=Value.")
+    query.add_argument("--store", default=store_path, help="Folder of the store.")
+    args = parser.parse_args(args)
+
+    if args.command == "ingest":
+        files = sorted(filename for pattern in args.files for filename in glob.glob(pattern))
+        print("CoCon: " + str(ingest(files, args.store)) + " sessions added to " + args.store)
+    else:
+        where = {}
+        for condition in args.where:
+            column, value = condition.split("=", 1)
+            where.setdefault(column, []).append(value)
+        values = Cohort(args.store).values(args.column, **where)
+        print(pd.Series(values).describe().to_string())
+
+
+if __name__ == "__main__":
+    main()
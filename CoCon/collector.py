@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+"""
+Cognitive Control Task: collection of the sessions of many stations into one cohort table.
+Authors: Makowski et al. (under review)
+Copyright: The Neuropsydia Development Team
+Site: https://github.com/DominiqueMakowski/CoCon.py
+
+Usage: python collector.py serve [--host 0.0.0.0] [--port 8765] [--output CoCon_cohort.csv]
+       python collector.py send ./Data/*.csv [--address 127.0.0.1:8765]
+
+Stations send each session as batches of rows (CSV text in JSON lines) over TCP. The collector
+queues them (a full queue stops reading, which holds back the stations), appends them to the cohort
+table and acknowledges each batch once it is on disk. Batches are identified by their content, so
+a station can resend whatever was not acknowledged: batches already stored are only acknowledged.
+Batches that cannot be stored (e.g., a full disk) are acknowledged as failed, so that stations send
+them again later, and batches with columns the cohort table does not have are rejected.
+"""
+
+import argparse
+import asyncio
+import glob
+import hashlib
+import io
+import json
+import os
+import socket
+import sys
+import threading
+
+import pandas as pd
+
+#==============================================================================
+# Initialization
+#==============================================================================
+port = 8765
+# Rows per batch, and batches sent ahead of their acknowledgement
+batch_size = 500
+window = 4
+retries = 5
+timeout = 30
+# Longest message (bytes)
+limit = 64*1024**2
+
+
+#==============================================================================
+# Station
+#==============================================================================
+def session_batches(df, station=""):
+    """
+    A session table as the messages sent to the collector.
+    """
+    session = str(df["Participant_ID"].iloc[0]) + "_" + str(df["Experiment_Start"].iloc[0]) if "Participant_ID" in df.columns else ""
+    chunks = range(0, max(len(df), 1), batch_size)
+    messages = []
+    for number, start in enumerate(chunks):
+        rows = df.iloc[start:start+batch_size].to_csv(index=False)
+        digest = hashlib.sha256((station + "\n" + session + "\n" + str(number) + "\n" + rows).encode("utf-8"))
+        messages.append({"id": digest.hexdigest()[:32], "station": station, "session": session,
+                         "batch": number, "batches": len(chunks), "rows": rows})
+    return(messages)
+
+
+
+async def send(messages, address, window=window, retries=retries, timeout=timeout):
+    """
+    Send messages to the collector (keeping up to window of them in flight), reconnecting and
+    resending the unacknowledged ones on failure. Returns the acknowledgements.
+    """
+    host, port = address.rsplit(":", 1)
+    unacked = {message["id"]: message for message in messages}
+    acks = {}
+    attempt = 0
+    while len(unacked) > 0:
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(host, int(port), limit=limit), timeout)
+            try:
+                pending = list(unacked)
+                in_flight = set()
+                while len(unacked) > 0:
+                    while len(in_flight) < window and len(pending) > 0:
+                        identifier = pending.pop(0)
+                        writer.write((json.dumps(unacked[identifier]) + "\n").encode("utf-8"))
+                        in_flight.add(identifier)
+                    await writer.drain()
+                    line = await asyncio.wait_for(reader.readline(), timeout)
+                    if not line:
+                        raise ConnectionError("CoCon: the collector closed the connection.")
+                    ack = json.loads(line)
+                    if ack["status"] == "failed":
+                        raise ConnectionError("CoCon: the collector could not store a batch.")
+                    acks[ack["ack"]] = ack["status"]
+                    unacked.pop(ack["ack"], None)
+                    in_flight.discard(ack["ack"])
+                    # Progress resets the retries
+                    attempt = 0
+            finally:
+                writer.close()
+        except (OSError, asyncio.TimeoutError, ValueError) as error:
+            attempt += 1
+            if attempt > retries:
+                raise ConnectionError("CoCon: could not reach the collector at " + address + " (" + repr(error) + ").")
+            await asyncio.sleep(0.1 * 2**attempt)
+    return(acks)
+
+
+
+def upload(df, address, station=None, **kwargs):
+    """
+    Send a session table to the collector (see send()), e.g., once processing() is done.
+    """
+    if station is None:
+        station = socket.gethostname()
+    return(asyncio.run(send(session_batches(df, station), address, **kwargs)))
+
+
+
+def upload_thread(df, address, station=None, **kwargs):
+    """
+    Send a session table to the collector in a thread (see upload()), e.g., while the end screen is
+    shown. Failures are reported on stderr.
+    """
+    def run():
+        try:
+            acks = upload(df, address, station, **kwargs)
+            if "rejected" in acks.values():
+                print("CoCon: the collector at " + address + " rejected the session (columns it does not have).", file=sys.stderr)
+        except ConnectionError as error:
+            # The session is saved locally anyway
+            print(str(error), file=sys.stderr)
+    thread = threading.Thread(target=run, name="Upload", daemon=True)
+    thread.start()
+    return(thread)
+
+
+
+#==============================================================================
+# Collector
+#==============================================================================
+class Collector():
+    """
+    Appends the batches received from the stations to a cohort table (CSV), with the identifiers of
+    the stored batches alongside (<output>.ids).
+    """
+    def __init__(self, output="CoCon_cohort.csv", queue_size=64, write_size=32):
+        self.output = output
+        self.write_size = write_size
+        self.queue = asyncio.Queue(queue_size)
+        # Batches waiting to be written, and the connections to acknowledge them to
+        self.pending = {}
+        self.ids = set()
+        if os.path.exists(output + ".ids"):
+            with open(output + ".ids") as ids:
+                self.ids = set(line.strip() for line in ids if line.strip() != "")
+        self.columns = None
+        if os.path.exists(output) and os.path.getsize(output) > 0:
+            self.columns = list(pd.read_csv(output, nrows=0).columns)
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                message = json.loads(line)
+                identifier = message["id"]
+                if identifier in self.ids:
+                    self.acknowledge(writer, identifier, "duplicate")
+                elif identifier in self.pending:
+                    self.pending[identifier].append(writer)
+                else:
+                    self.pending[identifier] = [writer]
+                    # Waits while the queue is full, holding back this station
+                    await self.queue.put(message)
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    def acknowledge(self, writer, identifier, status):
+        if writer.is_closing() is False:
+            writer.write((json.dumps({"ack": identifier, "status": status}) + "\n").encode("utf-8"))
+
+    def append(self, messages):
+        """
+        Append batches to the cohort table (aligned on its columns), then record them as stored.
+        Batches with columns the table does not have are left out. Returns the status of each batch.
+        """
+        tables = [pd.read_csv(io.StringIO(message["rows"]), keep_default_na=False, na_values=[""], float_precision="round_trip") for message in messages]
+        header = self.columns is None
+        columns = list(tables[0].columns) if header is True else self.columns
+        statuses = {message["id"]: "stored" if set(table.columns) <= set(columns) else "rejected" for message, table in zip(messages, tables)}
+        stored = [message for message in messages if statuses[message["id"]] == "stored"]
+        if len(stored) > 0:
+            rows = pd.concat([table.reindex(columns=columns) for message, table in zip(messages, tables) if statuses[message["id"]] == "stored"], ignore_index=True)
+            size = os.path.getsize(self.output) if os.path.exists(self.output) else 0
+            try:
+                with open(self.output, "a", newline="") as output:
+                    rows.to_csv(output, index=False, header=header)
+                    output.flush()
+                    os.fsync(output.fileno())
+                with open(self.output + ".ids", "a") as ids:
+                    ids.write("".join(message["id"] + "\n" for message in stored))
+                    ids.flush()
+                    os.fsync(ids.fileno())
+            except Exception:
+                # No partial rows left in the table
+                try:
+                    os.truncate(self.output, size)
+                except OSError:
+                    pass
+                raise
+            self.columns = columns
+        return(statuses)
+
+    async def store(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            messages = [await self.queue.get()]
+            while self.queue.empty() is False and len(messages) < self.write_size:
+                messages.append(self.queue.get_nowait())
+            try:
+                statuses = await loop.run_in_executor(None, self.append, messages)
+            except Exception as error:
+                # The stations send these batches again later
+                print("CoCon: could not store " + str(len(messages)) + " batches into " + self.output + " (" + repr(error) + ").", file=sys.stderr)
+                statuses = {message["id"]: "failed" for message in messages}
+            for message in messages:
+                if statuses[message["id"]] == "stored":
+                    self.ids.add(message["id"])
+                elif statuses[message["id"]] == "rejected":
+                    print("CoCon: rejected a batch of " + message["session"] + " (columns the cohort table does not have).", file=sys.stderr)
+                for writer in self.pending.pop(message["id"], []):
+                    self.acknowledge(writer, message["id"], statuses[message["id"]])
+
+    async def serve(self, host="127.0.0.1", port=port, ready=None):
+        """
+        Serve until cancelled (ready, an asyncio.Event, is set once listening).
+        """
+        server = await asyncio.start_server(self.handle, host, port, limit=limit)
+        storing = asyncio.ensure_future(self.store())
+        if ready is not None:
+            ready.set()
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            storing.cancel()
+
+
+
+#==============================================================================
+# Run
+#==============================================================================
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Collect the CoCon sessions of many stations into one cohort table.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve = commands.add_parser("serve", help="Run the collector.")
+    serve.add_argument("--host", default="0.0.0.0", help="Address to listen on.")
+    serve.add_argument("--port", type=int, default=port, help="Port to listen on.")
+    serve.add_argument("--output", default="CoCon_cohort.csv", help="Cohort table to append to.")
+    sending = commands.add_parser("send", help="Send saved sessions to a collector.")
+    sending.add_argument("files", nargs="+", help="Saved sessions (CSV).")
+    sending.add_argument("--address", default="127.0.0.1:" + str(port), help="host:port of the collector.")
+    sending.add_argument("--station", default=socket.gethostname(), help="Name of this station.")
+    args = parser.parse_args(args)
+
+    if args.command == "serve":
+        print("CoCon: collecting on " + args.host + ":" + str(args.port) + " into " + args.output)
+        try:
+            asyncio.run(Collector(args.output).serve(args.host, args.port))
+        except KeyboardInterrupt:
+            pass
+    else:
+        for pattern in args.files:
+            for filename in sorted(glob.glob(pattern)):
+                # "None" is a condition, not a missing value
+                df = pd.read_csv(filename, keep_default_na=False, na_values=[""], float_precision="round_trip")
+                try:
+                    acks = upload(df, args.address, station=args.station)
+                    print("CoCon: " + filename + " sent (" + str(list(acks.values()).count("stored")) + " batches stored, " + str(list(acks.values()).count("rejected")) + " rejected)")
+                except ConnectionError as error:
+                    print(str(error), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
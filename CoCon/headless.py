@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+Cognitive Control Task: headless display with a virtual clock.
+Authors: Makowski et al. (under review)
+Copyright: The Neuropsydia Development Team
+Site: https://github.com/DominiqueMakowski/CoCon.py
+
+Stands in for neuropsydia, so that whole sessions run without a screen or a keyboard, as fast as
+the CPU allows: waits, screen refreshes and responses only move a virtual clock forward.
+
+    import CoCon, headless
+    CoCon.testmode = False
+    df = CoCon.main(display=headless.Display(seed=0))
+
+Runs are fastest with the stimuli atlas built (see stimuli.py), as stimuli are otherwise rendered
+from the images at every session.
+"""
+
+import math
+import os
+
+import numpy as np
+
+#==============================================================================
+# Initialization
+#==============================================================================
+# Keys of the task (default responses)
+keys = ["DOWN", "RIGHT", "LEFT"]
+
+
+#==============================================================================
+# Display
+#==============================================================================
+class VirtualTime():
+    """
+    The part of neuropsydia.time that the task uses.
+    """
+    def __init__(self, display):
+        self.display = display
+
+    def wait(self, time_to_wait):
+        self.display.advance(time_to_wait)
+        return(time_to_wait)
+
+
+
+class Display():
+    """
+    The neuropsydia functions used by the task, headless.
+
+    Parameters
+    ----------
+    responses : iterable or function, optional
+        Scripted keyboard: (key, RT) pairs, or a function of (allow, time_max) returning one. A key
+        of None (or an RT beyond time_max) times out. Defaults to random keys from seed.
+    answers : iterable, optional
+        Answers to n.ask(), in order.
+    seed : int, optional
+        Seed of the default responses.
+    refresh_rate : float
+        Screen refreshes wait for the next frame of this rate (Hz).
+    reading_time : float
+        Time (ms) spent on each screen waiting for ENTER (e.g., instructions).
+    render : bool
+        Load, scale and draw the images on an off-screen surface (with pygame), e.g., to time them.
+    save : bool
+        Write n.save_data() tables as CSV files (they are kept in saved either way).
+    """
+    def __init__(self, responses=None, answers=None, seed=None, refresh_rate=60, reading_time=0,
+                 render=False, save=False, screen_width=1920, screen_height=1080, monitor_diagonal=24):
+        self.rng = np.random.default_rng(seed)
+        if responses is None:
+            responses = self.random_response
+        self.responses = responses if callable(responses) else iter(responses)
+        self.answers = iter(answers if answers is not None else [])
+        self.refresh_rate = refresh_rate
+        self.frame = 1e9 / refresh_rate
+        self.reading_time = reading_time
+        self.render = render
+        self.save = save
+        self.screen_width = screen_width
+        self.screen_height = screen_height
+        self.monitor_diagonal = monitor_diagonal
+
+        self.ns = 0
+        self.time = VirtualTime(self)
+        self.screen = None
+        self.saved = []
+        self.counts = {"image": 0, "preload": 0, "refresh": 0, "response": 0}
+
+    # Virtual clock
+    # -------------
+    def perf_counter_ns(self):
+        return(self.ns)
+
+    def advance(self, ms):
+        self.ns += int(round(ms * 1e6))
+
+    def sleep(self, seconds):
+        # Never short of the time asked (see timing.Scheduler)
+        self.ns += int(math.ceil(seconds * 1e9))
+
+    def random_response(self, allow, time_max):
+        allow = allow if allow is not None else keys
+        return(allow[self.rng.integers(len(allow))], self.rng.uniform(250, 900))
+
+    # Screen
+    # ------
+    def start(self, *args, **kwargs):
+        if self.render is True:
+            import pygame
+            self.screen = pygame.Surface((self.screen_width, self.screen_height))
+
+    def close(self, *args, **kwargs):
+        self.screen = None
+
+    def start_screen(self, *args, **kwargs):
+        self.advance(self.reading_time)
+
+    def end_screen(self, *args, **kwargs):
+        self.advance(self.reading_time)
+
+    def newpage(self, color_name="white", opacity=100, fade=False, fade_speed=60, fade_type="out", auto_refresh=True):
+        if self.screen is not None:
+            self.screen.fill((128, 128, 128) if color_name == "grey" else (255, 255, 255))
+        if auto_refresh is True:
+            self.refresh()
+
+    def refresh(self):
+        """
+        Wait for the next frame.
+        """
+        self.counts["refresh"] += 1
+        self.ns = int(round((math.floor(self.ns / self.frame) + 1) * self.frame))
+
+    def write(self, text="", style="body", *args, **kwargs):
+        if style == "end":
+            self.refresh()
+            self.advance(self.reading_time)
+
+    def ask(self, text="", *args, **kwargs):
+        self.advance(self.reading_time)
+        return(next(self.answers, "headless"))
+
+    # Images
+    # ------
+    def key(self, file, path="", extension="", size=1.0, unit="n", scale_by="height", rotate=0, opacity=100):
+        # Same key as neuropsydia
+        return(path + file + '_' + str(size) + '_' + unit + '_' + scale_by + '_' + str(rotate) + '_' + str(opacity) + '_' + str(self.monitor_diagonal) + '_' + extension)
+
+    def preload(self, file, x=0, y=0, cache=None, path="", extension="", size=1.0, unit="n", scale_by="height", rotate=0, opacity=100, **kwargs):
+        self.counts["preload"] += 1
+        if cache is None:
+            cache = {}
+        image = None
+        if self.render is True:
+            import pygame
+            image = pygame.image.load(path + file + extension)
+            height = int(size * self.screen_height / 20)
+            image = pygame.transform.smoothscale(image, (int(image.get_width() * height / image.get_height()), height))
+            image = pygame.transform.rotate(image, rotate)
+        cache[self.key(file, path, extension, size, unit, scale_by, rotate, opacity)] = image
+        return(cache)
+
+    def image(self, file, x=0, y=0, cache=None, path="", extension="", size=1.0, unit="n", scale_by="height", rotate=0, opacity=100, **kwargs):
+        self.counts["image"] += 1
+        key = self.key(file, path, extension, size, unit, scale_by, rotate, opacity)
+        if cache is None or key not in cache:
+            cache = self.preload(file, cache=cache, path=path, extension=extension, size=size, unit=unit, scale_by=scale_by, rotate=rotate, opacity=opacity)
+        image = cache[key]
+        if self.screen is not None and image is not None:
+            self.screen.blit(image, image.get_rect(center=(self.screen_width/2 + x*self.screen_height/20, self.screen_height/2 - y*self.screen_height/20)))
+        return(cache)
+
+    # Keyboard
+    # --------
+    def response(self, allow=None, enable_escape=True, time_max=None, get_RT=True):
+        self.counts["response"] += 1
+        if callable(self.responses):
+            key, RT = self.responses(allow, time_max)
+        else:
+            key, RT = next(self.responses)
+        if key is None or (time_max is not None and RT > time_max):
+            key, RT = "Time_Max_Exceeded", time_max
+        self.advance(RT)
+        if get_RT is False:
+            return(key)
+        return(key, RT)
+
+    # Data
+    # ----
+    def save_data(self, df, filename="data", path="", participant_id="", **kwargs):
+        self.saved.append((filename, df))
+        if self.save is True:
+            if path != "" and os.path.exists(path) is False:
+                os.makedirs(path)
+            df.to_csv(path + participant_id + "_" + filename + ".csv", **kwargs)
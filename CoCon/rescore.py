@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+Cognitive Control Task: batch rescoring of the saved sessions.
+Authors: Makowski et al. (under review)
+Copyright: The Neuropsydia Development Team
+Site: https://github.com/DominiqueMakowski/CoCon.py
+
+Usage: python rescore.py [--path ./Data/] [--output CoCon_cohort.csv] [--jobs N]
+"""
+
+import argparse
+import concurrent.futures
+import glob
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+import responses
+import scoring
+import timing
+
+#==============================================================================
+# Initialization
+#==============================================================================
+# Columns written by sequence() and run_trials(), i.e., before any scoring
+trial_columns = ["Condition_Response_Selection", "Condition_Inhibition", "Condition_Conflict",
+                 "Global_Shape", "Global_Color", "Global_Angle",
+                 "Local_Shape", "Local_Color", "Local_Angle",
+                 "Inhibition", "Conflict", "Response_Availability", "Response_Correct",
+                 "Order", "Time_Trial_Onset", "Prestimulus_Interval", "Time_Stimulus_Onset",
+                 "Response", "RT"]
+# Columns added once per session by the task script
+session_columns = ["Participant_ID", "Experiment_Start", "Experiment_End", "Version", "Experiment_Duration"]
+block_columns = ["Condition_Response_Selection", "Condition_Inhibition", "Condition_Conflict"]
+
+
+#==============================================================================
+# Sessions
+#==============================================================================
+def read_session(filename):
+    """
+    Recover the raw trials of a saved session, as run_trials() returned them, split by block.
+    """
+    # "None" is a condition, not a missing value
+    df = pd.read_csv(filename, keep_default_na=False, na_values=[""])
+    session = df[[column for column in session_columns if column in df.columns]].iloc[0]
+    df = df[trial_columns + [column for column in timing.timing_measures + responses.capture_columns if column in df.columns]].copy()
+
+    # statistics() stored the "NA" responses as missing values
+    df["Response"] = [response if pd.notnull(response) else "NA" for response in df["Response"]]
+    df["Response_Correct"] = [int(angle) if pd.notnull(angle) else "NA" for angle in df["Response_Correct"]]
+
+    # processing() renumbers trials within conditions: restore the presentation order of each block
+    df["Time_Trial_Onset"] = pd.to_datetime(df["Time_Trial_Onset"])
+    blocks = []
+    for _, block in df.groupby(block_columns, sort=False):
+        block = block.sort_values("Time_Trial_Onset", kind="stable").reset_index(drop=True)
+        block["Order"] = np.arange(1, len(block)+1)
+        blocks.append(block)
+    return(blocks, session)
+
+
+
+def rescore_session(filename):
+    blocks, session = read_session(filename)
+    df = scoring.processing([scoring.statistics(block) for block in blocks])
+    for column, value in session.items():
+        df[column] = value
+    df["File"] = os.path.basename(filename)
+    return(df)
+
+
+
+def rescore(path="./Data/", pattern="*.csv", jobs=None):
+    """
+    Rescore every session of the folder in a pool of processes (one per core by default).
+    """
+    files = sorted(glob.glob(os.path.join(path, pattern)))
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+
+    dfs = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        for filename, future in [(filename, executor.submit(rescore_session, filename)) for filename in files]:
+            try:
+                dfs.append(future.result())
+            except Exception as error:
+                print("CoCon: could not rescore " + filename + " (" + repr(error) + ")", file=sys.stderr)
+    if len(dfs) == 0:
+        return(pd.DataFrame())
+    return(pd.concat(dfs, ignore_index=True))
+
+
+
+#==============================================================================
+# Run
+#==============================================================================
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Rescore the saved CoCon sessions into one cohort table.")
+    parser.add_argument("--path", default="./Data/", help="Folder containing the saved sessions.")
+    parser.add_argument("--pattern", default="*.csv", help="Filename pattern of the sessions.")
+    parser.add_argument("--output", default="CoCon_cohort.csv", help="Cohort table to write.")
+    parser.add_argument("--jobs", type=int, default=None, help="Number of processes (default: number of cores).")
+    args = parser.parse_args(args)
+
+    df = rescore(args.path, pattern=args.pattern, jobs=args.jobs)
+    df.to_csv(args.output, index=False)
+    print("CoCon: " + str(df["File"].nunique() if len(df) > 0 else 0) + " sessions rescored into " + args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+Cognitive Control Task: keyboard capture stamped on the clock of the trials.
+Authors: Makowski et al. (under review)
+Copyright: The Neuropsydia Development Team
+Site: https://github.com/DominiqueMakowski/CoCon.py
+
+A KeyListener drains the key presses often, during the prestimulus wait as well as while waiting
+for the response, and stamps each one with the clock of the trials, so that RTs are measured from
+the stimulus onset to the press itself rather than to the moment the keyboard happens to be polled.
+Presses made before the onset are kept apart as anticipations. SDL only delivers the events of a
+window to the thread that created it (on Windows as on macOS), so presses are drained from the
+main thread, between the steps of the trial.
+"""
+
+import collections
+import time
+
+#==============================================================================
+# Initialization
+#==============================================================================
+# Per-trial columns recorded by run_trials() when responses are captured
+capture_columns = ["Anticipations", "Anticipation_Time"]
+
+
+#==============================================================================
+# Sources
+#==============================================================================
+class PygameKeys():
+    """
+    The key presses (KEYDOWN events) of the pygame window, named as neuropsydia names them. To be
+    read from the thread that created the window.
+    """
+    def __init__(self):
+        import pygame
+        self.pygame = pygame
+        self.names = {pygame.K_DOWN: "DOWN", pygame.K_UP: "UP", pygame.K_LEFT: "LEFT", pygame.K_RIGHT: "RIGHT",
+                      pygame.K_RETURN: "ENTER", pygame.K_SPACE: "SPACE", pygame.K_ESCAPE: "ESCAPE"}
+        # neuropsydia blocks key presses outside of its own response functions
+        self.blocked = pygame.event.get_blocked(pygame.KEYDOWN)
+        pygame.event.set_allowed(pygame.KEYDOWN)
+
+    def read(self):
+        return([self.names.get(event.key, self.pygame.key.name(event.key)) for event in self.pygame.event.get(self.pygame.KEYDOWN)])
+
+    def close(self):
+        if self.blocked is True:
+            self.pygame.event.set_blocked(self.pygame.KEYDOWN)
+
+
+
+#==============================================================================
+# Listener
+#==============================================================================
+class KeyListener():
+    """
+    Drains a source of key presses (see PygameKeys) at every pump(), stamping each press with
+    counter() (ns, e.g., the counter of a timing.Clock). sleep() and wait() pump every interval (s),
+    so that presses are stamped at most that late, except those made while the stimulus is drawn
+    and flipped (stamped once it is shown). sleep is the function that sleeps between pumps (e.g.,
+    that of a virtual clock).
+    """
+    def __init__(self, source=None, counter=None, interval=0.0005, sleep=None):
+        self.source = source
+        self.counter = counter if counter is not None else time.perf_counter_ns
+        self.interval = interval
+        self.nap = sleep if sleep is not None else time.sleep
+        self.events = collections.deque()
+
+    def start(self):
+        if self.source is None:
+            self.source = PygameKeys()
+        return(self)
+
+    def stop(self):
+        if hasattr(self.source, "close"):
+            self.source.close()
+
+    def pump(self):
+        keys = self.source.read()
+        if len(keys) > 0:
+            now = self.counter()
+            self.events.extend((now, key) for key in keys)
+
+    def sleep(self, seconds):
+        """
+        Sleep (e.g., as the sleep of a timing.Scheduler), draining the presses meanwhile.
+        """
+        end = self.counter() + int(seconds * 1e9)
+        while True:
+            self.pump()
+            remaining = (end - self.counter()) / 1e9
+            if remaining <= 0:
+                return
+            self.nap(min(self.interval, remaining))
+
+    def discard(self):
+        """
+        Drop the presses captured so far (e.g., late presses of the previous trial).
+        """
+        self.pump()
+        self.events.clear()
+
+    def anticipations(self, before):
+        """
+        Remove and return the (ns, key) presses made before a time (e.g., the stimulus onset).
+        """
+        self.pump()
+        early = []
+        while len(self.events) > 0 and self.events[0][0] < before:
+            early.append(self.events.popleft())
+        return(early)
+
+    def poll(self, allow=None):
+        """
+        The first (ns, key) press among allowed keys, without waiting (None if there is none yet).
+        Presses of other keys are dropped.
+        """
+        self.pump()
+        while len(self.events) > 0:
+            event = self.events.popleft()
+            if allow is None or event[1] in allow:
+                return(event)
+        return(None)
+
+    def wait(self, allow=None, deadline=None):
+        """
+        The first (ns, key) press among allowed keys, waiting for it until the deadline (ns).
+        Returns None if the deadline passes first.
+        """
+        while True:
+            event = self.poll(allow)
+            if event is not None:
+                return(event)
+            if deadline is None:
+                self.nap(self.interval)
+                continue
+            remaining = (deadline - self.counter()) / 1e9
+            if remaining <= 0:
+                return(None)
+            self.nap(min(self.interval, remaining))
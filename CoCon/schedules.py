@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+"""
+Cognitive Control Task: trial sequences under ordering constraints, and pools of them.
+Authors: Makowski et al. (under review)
+Copyright: The Neuropsydia Development Team
+Site: https://github.com/DominiqueMakowski/CoCon.py
+
+Usage: python schedules.py [--count 1000] [--seed 0] [--check]
+
+Sequences keep the trials of the same local angle or color from running too long, and the no-go
+and no-response trials apart, with the colors and angles of each kind of trial balanced. Many
+sequences are ordered at once, trial by trial, each next trial being drawn among those that keep
+the constraints (sequences that reach a dead end are started again). A pool of them can also be
+built once per station, so that sessions only draw from it.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+
+import numpy as np
+
+import sequences
+
+#==============================================================================
+# Initialization
+#==============================================================================
+# Longest run of consecutive trials with the same value
+max_runs = {"Local_Angle": 3, "Global_Color": 3, "Local_Color": 3}
+# Fewest trials from one trial of a kind to the next: (column, value): distance
+min_spacing = {("Inhibition", True): 3, ("Response_Availability", False): 3}
+# Orderings started again before giving up
+attempts = 100
+# Random swaps of two trials per trial of the block, after the first order
+swaps = 10
+# Largest relative departure from an even spread of each spaced kind over the parts of a block
+position_tolerance = 0.1
+pool_path = "./Sequences/"
+pool_count = 1000
+
+
+#==============================================================================
+# Constraints
+#==============================================================================
+def violations(table, max_runs=max_runs, min_spacing=min_spacing):
+    """
+    Whether each sequence of a sequence table breaks the constraints.
+    """
+    bad = np.zeros(table["Local_Angle"].shape[0], dtype=bool)
+    for column, limit in max_runs.items():
+        same = table[column][:, 1:] == table[column][:, :-1]
+        # Runs longer than the limit: limit pairs of equal neighbours in a row
+        width = same.shape[1] - limit + 1
+        if width > 0:
+            run = same[:, :width].copy()
+            for lag in range(1, limit):
+                run &= same[:, lag:lag+width]
+            bad |= run.any(axis=1)
+    for (column, value), distance in min_spacing.items():
+        kind = table[column] == value
+        for lag in range(1, distance):
+            bad |= (kind[:, lag:] & kind[:, :-lag]).any(axis=1)
+    return(bad)
+
+
+
+def constrained_orders(table, rng, max_runs=max_runs, min_spacing=min_spacing):
+    """
+    A first order of the trials of each sequence of a table, built trial by trial, for all the
+    sequences at once. Trials of a spaced kind are drawn more readily, so that they are not left for
+    the end (which would end in dead ends): these orders crowd them at the start of the block, and
+    are only a start for mix_orders(). Returns the orders (n, trials) and whether each sequence
+    reached a dead end.
+    """
+    n, length = table["Local_Angle"].shape
+    rows = np.arange(n)
+    remaining = np.ones((n, length), dtype=bool)
+    orders = np.zeros((n, length), dtype=np.intp)
+    failed = np.zeros(n, dtype=bool)
+
+    runs = {column: (table[column].astype(np.int64), np.full(n, np.iinfo(np.int64).min), np.zeros(n, dtype=np.intp)) for column in max_runs}
+    kinds = [(table[column] == value, distance, np.full(n, -distance)) for (column, value), distance in min_spacing.items()]
+    weights = np.ones((n, length))
+    for kind, distance, last in kinds:
+        weights[kind] *= distance
+
+    for position in range(length):
+        allowed = remaining.copy()
+        for column, (values, previous, run) in runs.items():
+            allowed &= ~((run >= max_runs[column])[:, None] & (values == previous[:, None]))
+        for kind, distance, last in kinds:
+            allowed &= ~(kind & (position - last < distance)[:, None])
+        cumulative = np.cumsum(np.where(allowed, weights, 0), axis=1)
+        total = cumulative[:, -1]
+        failed |= total == 0
+        # Weighted draw of one allowed trial per sequence (dead ends take any trial left)
+        cumulative = np.where(total[:, None] == 0, np.cumsum(remaining, axis=1), cumulative)
+        draw = (1 - rng.random(n)) * cumulative[:, -1]
+        pick = np.minimum((cumulative < draw[:, None]).sum(axis=1), length - 1)
+
+        orders[:, position] = pick
+        remaining[rows, pick] = False
+        for column, (values, previous, run) in runs.items():
+            value = values[rows, pick]
+            run[:] = np.where(value == previous, run + 1, 1)
+            previous[:] = value
+        for kind, distance, last in kinds:
+            last[:] = np.where(kind[rows, pick], position, last)
+    return(orders, failed)
+
+
+
+def mix_orders(table, orders, rng, steps, max_runs=max_runs, min_spacing=min_spacing):
+    """
+    Mix orders that keep the constraints by steps random swaps of two trials, each kept only if the
+    constraints still hold. The swaps are drawn uniformly, so that the orders tend to be drawn
+    uniformly among all those that keep the constraints.
+    """
+    n, length = orders.shape
+    rows = np.arange(n)
+    columns = list(max_runs) + [column for column, value in min_spacing]
+    for step in range(steps):
+        first, second = rng.integers(length, size=(2, n))
+        swapped = orders.copy()
+        swapped[rows, first], swapped[rows, second] = orders[rows, second], orders[rows, first]
+        ordered = {column: np.take_along_axis(table[column], swapped, axis=1) for column in columns}
+        keep = ~violations(ordered, max_runs, min_spacing)
+        orders = np.where(keep[:, None], swapped, orders)
+    return(orders)
+
+
+
+def position_balance(table, parts=4, min_spacing=min_spacing):
+    """
+    How evenly each spaced kind of trial is spread over the block, over the sequences of a table:
+    for each kind, the mean count in each part of the block (e.g., quarters), relative to its count
+    if it were spread evenly (1 for an even spread). Also returns the standard error of each ratio.
+    """
+    balance = {}
+    for (column, value), distance in min_spacing.items():
+        kind = table[column] == value
+        expected = kind.mean()
+        if expected == 0:
+            continue
+        ratios, errors = [], []
+        for positions in np.array_split(np.arange(kind.shape[1]), parts):
+            counts = kind[:, positions].sum(axis=1) / (expected * len(positions))
+            ratios.append(counts.mean())
+            errors.append(counts.std() / np.sqrt(len(counts)))
+        balance[(column, value)] = (np.array(ratios), np.array(errors))
+    return(balance)
+
+
+
+def check_positions(table, parts=4, tolerance=position_tolerance, min_spacing=min_spacing):
+    """
+    Raise an error if a spaced kind of trial is crowded in a part of the block, over the sequences
+    of a table (beyond the tolerance, and beyond what their number can explain).
+    """
+    for (column, value), (ratios, errors) in position_balance(table, parts, min_spacing).items():
+        if (np.abs(ratios - 1) > tolerance + 4*errors).any():
+            raise ValueError("CoCon: trials where " + column + " is " + str(value) + " are not spread evenly over the block " +
+                             "(" + ", ".join("%.2f" % ratio for ratio in ratios) + " of an even spread in each part).")
+
+
+
+def constrained_table(block, n=1, rng=None, max_runs=max_runs, min_spacing=min_spacing):
+    """
+    Draw n sequences of a block that keep the constraints, as sequence_table() does.
+    """
+    rng = np.random.default_rng(rng)
+    table = sequences.sequence_table(block, n, rng, balanced=True)
+    columns = [column for column, values in table.items() if isinstance(values, np.ndarray)]
+    todo = np.arange(n)
+    for attempt in range(attempts):
+        subset = {column: table[column][todo] for column in columns}
+        orders, failed = constrained_orders(subset, rng, max_runs, min_spacing)
+        done = todo[~failed]
+        subset = {column: subset[column][~failed] for column in columns}
+        orders = mix_orders(subset, orders[~failed], rng, swaps*orders.shape[1], max_runs, min_spacing)
+        for column in columns:
+            table[column][done] = np.take_along_axis(subset[column], orders, axis=1)
+        todo = todo[failed]
+        if len(todo) == 0:
+            return(table)
+    raise ValueError("CoCon: no order of the trials of the block keeps the constraints (see max_runs and min_spacing).")
+
+
+
+#==============================================================================
+# Pool
+#==============================================================================
+def pool_hash(max_runs=max_runs, min_spacing=min_spacing):
+    """
+    Hash of the blocks, of the constraints their sequences were drawn under and of their mixing.
+    """
+    spacing = [[column, value, distance] for (column, value), distance in min_spacing.items()]
+    content = json.dumps([sequences.blocks, sequences.categories, max_runs, spacing, swaps], sort_keys=True)
+    return(hashlib.sha256(content.encode("utf-8")).hexdigest())
+
+
+
+def pool_filename(path=pool_path):
+    return(os.path.join(path, "CoCon_" + pool_hash()[:16] + ".npz"))
+
+
+
+def build_pool(count=pool_count, seed=0, path=pool_path):
+    """
+    Draw count sequences of each block and store them in a single file, named after the blocks and
+    constraints so that a change in either is never served from a stale pool. The sequences are
+    checked against the constraints, and for an even spread of each spaced kind over the block.
+    """
+    rng = np.random.default_rng(seed)
+    arrays = {}
+    for number, block in enumerate(sequences.blocks):
+        table = constrained_table(block, count, rng)
+        if violations(table).any():
+            raise ValueError("CoCon: sequences of block " + str(number+1) + " break the constraints.")
+        check_positions(table)
+        for column, values in table.items():
+            if isinstance(values, np.ndarray):
+                arrays[str(number) + "/" + column] = values
+
+    if os.path.exists(path) is False:
+        os.makedirs(path)
+    filename = pool_filename(path)
+    with open(filename + ".tmp", "wb") as pool:
+        np.savez(pool, **arrays)
+    os.replace(filename + ".tmp", filename)
+    return(filename)
+
+
+
+def load_pool(path=pool_path):
+    """
+    The pool of sequences built for these blocks and constraints, as a sequence table per block
+    (by number), or None if there is none.
+    """
+    filename = pool_filename(path)
+    if os.path.isfile(filename) is False:
+        return(None)
+    conditions = ["Condition_Response_Selection", "Condition_Inhibition", "Condition_Conflict"]
+    pool = {number: {condition: block[condition] for condition in conditions} for number, block in enumerate(sequences.blocks)}
+    with np.load(filename) as arrays:
+        for key in arrays.files:
+            number, column = key.split("/", 1)
+            pool[int(number)][column] = arrays[key]
+    return(pool)
+
+
+
+def trial_store(response_selection="None", inhibition=False, conflict=False, rng=None, pool=None):
+    """
+    Trials of a block (see sequences.trial_store()), drawn from the pool if there is one, or else
+    ordered under the constraints.
+    """
+    rng = np.random.default_rng(rng)
+    block = sequences.block_spec(response_selection, inhibition, conflict)
+    number = sequences.blocks.index(block)
+    if pool is not None:
+        table = pool[number]
+    else:
+        table = constrained_table(block, 1, rng)
+    return(sequences.trial_store(response_selection, inhibition, conflict, rng, table=table))
+
+
+
+#==============================================================================
+# Run
+#==============================================================================
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Build the pool of constrained trial sequences for a testing station.")
+    parser.add_argument("--count", type=int, default=pool_count, help="Sequences per block.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the pool.")
+    parser.add_argument("--path", default=pool_path, help="Folder of the pool.")
+    parser.add_argument("--check", action="store_true", help="Only report how evenly each spaced kind of trial is spread over the quarters of each block.")
+    args = parser.parse_args(args)
+    if args.check is True:
+        rng = np.random.default_rng(args.seed)
+        for number, block in enumerate(sequences.blocks):
+            for (column, value), (ratios, errors) in position_balance(constrained_table(block, args.count, rng)).items():
+                print("Block " + str(number+1) + ", " + column + " = " + str(value) + ": " + " ".join("%.2f" % ratio for ratio in ratios))
+        return
+    filename = build_pool(args.count, args.seed, args.path)
+    print("CoCon: pool of sequences written to " + filename)
+
+
+if __name__ == "__main__":
+    main()
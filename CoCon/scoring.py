@@ -0,0 +1,385 @@
+# -*- coding: utf-8 -*-
+"""
+Cognitive Control Task: scoring.
+Authors: Makowski et al. (under review)
+Copyright: The Neuropsydia Development Team
+Site: https://github.com/DominiqueMakowski/CoCon.py
+"""
+
+import numpy as np
+import pandas as pd
+
+#==============================================================================
+# Initialization
+#==============================================================================
+angle_to_orientation = {-90:"LEFT", 90:"RIGHT", 0:"DOWN", 180:"UP", "NA":"NA"}
+# Colors contrasts
+colors_ref = {"white": (255, 255, 255),
+              "red": (255, 85, 54),
+              "yellow": (255,235,59),
+              "blue": (33,150,243)}
+# Luminance and contrast tables, filled once per palette by color_table()
+color_tables = {}
+# Scoring conditions and trial types, in the order processing() reports them
+scoring_conditions = ["Core", "Response_Selection", "Neutral", "Congruent", "Incongruent"]
+trial_types = ["Go", "Unavailable", "Inhibition", "Double"]
+
+
+#==============================================================================
+# Colors
+#==============================================================================
+def color_luminance(color):
+    """
+    Perceived luminance of an RGB color (same formula as neuropsydia's color_luminance()).
+    """
+    r, g, b = np.array(color[:3])/255
+    return(np.sqrt(0.299*(r**2) + 0.587*(g**2) + 0.114*(b**2)))
+
+
+
+def color_contrast(color1, color2):
+    """
+    Contrast ratio between two RGB colors (same formula as neuropsydia's color_contrast()).
+    """
+    l1 = color_luminance(color1)
+    l2 = color_luminance(color2)
+    return((max(l1, l2) + 0.05) / (min(l1, l2) + 0.05))
+
+
+
+def color_table(colors=None):
+    """
+    Luminance of each color and contrast of each (global, local) pair of the palette.
+    """
+    if colors is None:
+        colors = colors_ref
+    key = tuple(colors.items())
+    if key not in color_tables:
+        names = list(colors.keys())
+        luminance = np.array([color_luminance(colors[name]) for name in names])
+        contrast = np.array([[color_contrast(colors[glob], colors[loc]) for loc in names] for glob in names])
+        color_tables[key] = (names, luminance, contrast)
+    return(color_tables[key])
+
+
+
+def color_properties(global_color, local_color, colors=None):
+    """
+    Map the global and local colors of each trial onto their luminances and contrast.
+    """
+    names, luminance, contrast = color_table(colors)
+    glob = pd.Categorical(global_color, categories=names).codes
+    loc = pd.Categorical(local_color, categories=names).codes
+    if (glob < 0).any() or (loc < 0).any():
+        unknown = set(np.asarray(global_color)[glob < 0]) | set(np.asarray(local_color)[loc < 0])
+        raise KeyError("Colors missing from colors_ref: " + ", ".join(sorted(map(str, unknown))))
+    return(luminance[glob], luminance[loc], contrast[glob, loc])
+
+
+
+#==============================================================================
+# Block statistics
+#==============================================================================
+def cumulative_moments(rt, valid):
+    """
+    Running mean, SD and SE of the valid RTs, in a single pass (Welford's update, vectorized).
+    """
+    rt = np.asarray(rt, dtype=float)
+    valid = np.asarray(valid, dtype=bool)
+    missing = np.cumsum(valid & np.isnan(rt)) > 0
+    valid = valid & ~np.isnan(rt)
+
+    count = np.cumsum(valid)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        average = np.cumsum(np.where(valid, rt, 0)) / count
+        previous = np.concatenate([[np.nan], average[:-1]])
+        m2 = np.cumsum(np.where(valid & (count > 1), (rt - previous) * (rt - average), 0))
+        sd = np.where(count > 1, np.sqrt(m2 / (count - 1)), np.nan)
+        # As with scipy.stats.sem, a missing RT leaves the SE undefined
+        se = np.where((count > 1) & ~missing, sd / np.sqrt(count), np.nan)
+    return(average, sd, se)
+
+
+
+def statistics(data):
+    df = pd.DataFrame.from_dict(data)
+
+    # Scores
+    df["Response_Correct_Orientation"] = df["Response_Correct"].map(angle_to_orientation).fillna("NA")
+    no_response = df["Response"].isnull() & (df["Response_Correct_Orientation"]=="NA")
+    df["Correct"] = np.where((df["Response"]==df["Response_Correct_Orientation"]) | no_response, 1, 0)
+    df["Color_Congruence"] = np.where(df["Local_Color"]==df["Global_Color"], True, False)
+
+    # Response Type - STD
+#    df = df.reset_index()
+#    response_type = []
+#    for row in range(len(df)):
+#        if df["Correct"][row]==1 and df["Response_Correct_Orientation"][row]!="NA":
+#            response_type.append("Hit")
+#        if df["Correct"][row]==1 and df["Response_Correct_Orientation"][row]=="NA":
+#            response_type.append("Correct_Rejection")
+#        if df["Correct"][row]==0 and df["Response_Correct_Orientation"][row]!="NA":
+#            response_type.append("Miss")
+#        if df["Correct"][row]==0 and df["Response_Correct_Orientation"][row]=="NA":
+#            response_type.append("False_Alarm")
+#    df["Response_Type"] = response_type
+
+
+
+    # Luminance and contrast
+    df["Luminance_Global"], df["Luminance_Local"], df["Contrast"] = color_properties(df["Global_Color"], df["Local_Color"])
+
+    if df["Condition_Conflict"].values[0] == False:
+        dfs = [df.reindex()]
+    else:
+        dfs = [df[df["Conflict"]=="Congruent"].sort_values("Order").reindex(), df[df["Conflict"]=="Incongruent"].sort_values("Order").reindex()]
+
+    for data in dfs:
+        valid = (data["Correct"]==1) & (data["Response_Correct_Orientation"]!="NA")
+        average, sd, se = cumulative_moments(data["RT"].values, valid.values)
+        # Row i summarises the trials labelled 0..i (the former data.loc[0:row] slice)
+        last = np.searchsorted(data.index.values, np.arange(len(data)), side="right") - 1
+        data["Cumulative_Average"] = np.where(last >= 0, average[last], np.nan)
+        data['Cumulative_SD'] = np.where(last >= 0, sd[last], np.nan)
+        data['Cumulative_SE'] = np.where(last >= 0, se[last], np.nan)
+    df = pd.concat(dfs)
+    df.sort_values("Order")
+    df = df.replace("NA", np.nan)
+
+    return(df)
+
+#==============================================================================
+# Processing
+#==============================================================================
+def condition_key(df):
+    """
+    Scoring condition of each trial (NaN for trials outside the five scored conditions).
+    """
+    conditional = df["Condition_Response_Selection"]=="Conditional"
+    inhibition = df["Condition_Inhibition"]==True
+    conflict = df["Condition_Conflict"]==True
+    key = np.select([df["Condition_Response_Selection"]=="None",
+                     conditional & ~inhibition & ~conflict,
+                     conditional & inhibition & ~conflict,
+                     conditional & inhibition & conflict & (df["Conflict"]=="Congruent"),
+                     conditional & inhibition & conflict & (df["Conflict"]=="Incongruent")],
+                    scoring_conditions, default="")
+    return(pd.Categorical(key, categories=scoring_conditions))
+
+
+
+def trial_type(df):
+    """
+    Go, no-response (Unavailable), no-go (Inhibition) or both (Double).
+    """
+    availability = (df["Response_Availability"]==True).values
+    inhibition = (df["Inhibition"]==True).values
+    codes = np.where(availability, 0, 1) + np.where(inhibition, 2, 0)
+    return(pd.Categorical.from_codes(codes, categories=trial_types))
+
+
+
+def processing(dfs, scorer=None):
+    df = pd.concat(dfs)
+
+    # Condition key, with the conditions stacked in scoring order
+    codes = condition_key(df).codes
+    rows = np.flatnonzero(codes >= 0)
+    rows = rows[np.argsort(codes[rows], kind="stable")]
+    df = df.iloc[rows].copy()
+    key = pd.Categorical.from_codes(codes[rows], categories=scoring_conditions)
+    order = df.groupby(key, observed=False).cumcount().values
+    df.index = order
+    df["Order"] = order+1
+
+    # Scores already accumulated trial by trial (see OnlineScorer)
+    if scorer is not None:
+        lower, upper = scorer.bounds()
+        df["Outliers"] = np.greater(df["RT"], upper[key.codes]) | np.less(df["RT"], lower[key.codes])
+        for score, value in scorer.scores().items():
+            df[score] = value
+        return(df)
+
+    # Speed: First computation with outliers
+    scored = (df["Correct"]==1) & (df["Response_Correct"].isnull()==False)
+    grouped = df["RT"].where(scored).groupby(key, observed=False)
+
+    # Outliers detection
+    average = grouped.transform("mean")
+    sd = grouped.transform("std")
+    df["Outliers"] = np.greater(df["RT"], average+sd*1.96) | np.less(df["RT"], average-sd*1.96)
+
+    # Speed: Second computation without outliers
+    speed = df["RT"].where(scored & (df["Outliers"]==False)).groupby(key, observed=False).agg(["mean", "std"])
+    rt = speed["mean"]
+
+    df["Speed_Core"] = rt["Core"]
+    df["Speed_Core_Variability"] = speed["std"]["Core"]
+    df["Speed_Response_Selection_Effect"] = rt["Response_Selection"] - rt["Core"]
+    df["Speed_Inhibition_Effect"] = rt["Neutral"] - rt["Response_Selection"]
+    df["Speed_Congruence_Effect"] = rt["Congruent"] - rt["Neutral"]
+    df["Speed_Incongruence_Effect"] = rt["Incongruent"] - rt["Neutral"]
+
+    # Errors
+    counts = pd.crosstab([key, trial_type(df)], df["Correct"]==0, dropna=False).reindex(columns=[False, True], fill_value=0)
+    errors = counts[True].unstack()
+    trials = counts.sum(axis=1).unstack()
+    conditional = errors.index!="Core"
+
+    df["Errors_Total"] = errors[conditional].values.sum() / len(df)
+    df["Errors_Orientation"] = errors["Go"][conditional].sum() / trials["Go"][conditional].sum()
+    df["Errors_Response_Selection"] = (errors["Unavailable"].sum()+errors["Double"].sum()) / (trials["Unavailable"].sum()+trials["Double"].sum())
+    df["Errors_Inhibition"] = (errors["Inhibition"].sum()+errors["Double"].sum()) / (trials["Inhibition"].sum()+trials["Double"].sum())
+
+    # IES: Inverse Efficiency Score
+    ies = rt/(1-errors["Go"]/trials["Go"])
+    for condition in ["Neutral", "Congruent", "Incongruent"]:
+        df["IES_" + condition] = ies[condition]
+        df["IES_" + condition + "_log"] = np.log(ies[condition])
+
+    return(df)
+
+
+
+class OnlineScorer():
+    """
+    The session scores of processing(), accumulated as each trial is answered: the running RT
+    moments of each scoring condition (hence its outlier bounds), and the trial and error counts of
+    each (condition, trial type). Only the final mean without outliers is left for the end of the
+    session, over the few scored RTs of each condition.
+    """
+    def __init__(self):
+        self.trials = np.zeros((len(scoring_conditions), len(trial_types)), dtype=int)
+        self.errors = np.zeros((len(scoring_conditions), len(trial_types)), dtype=int)
+        self.count = np.zeros(len(scoring_conditions), dtype=int)
+        self.mean = np.zeros(len(scoring_conditions))
+        self.m2 = np.zeros(len(scoring_conditions))
+        self.rt = [[] for condition in scoring_conditions]
+
+    def update(self, condition, trial_type, correct, rt, scored):
+        """
+        Add a trial (condition and trial_type are codes, see sequences.block_codes()). scored marks
+        a correct trial with an expected response.
+        """
+        if condition < 0:
+            return
+        self.trials[condition, trial_type] += 1
+        self.errors[condition, trial_type] += not correct
+        if scored and rt == rt:
+            # Welford's update
+            self.count[condition] += 1
+            delta = rt - self.mean[condition]
+            self.mean[condition] += delta / self.count[condition]
+            self.m2[condition] += delta * (rt - self.mean[condition])
+            self.rt[condition].append(rt)
+
+    def se(self):
+        """
+        Running SE of the scored RTs of each scoring condition.
+        """
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return(np.where(self.count > 1, np.sqrt(self.m2 / (self.count - 1) / self.count), np.nan))
+
+    def bounds(self):
+        """
+        Outlier bounds (mean +/- 1.96 SD of the scored RTs) of each scoring condition.
+        """
+        with np.errstate(invalid="ignore", divide="ignore"):
+            average = np.where(self.count > 0, self.mean, np.nan)
+            sd = np.where(self.count > 1, np.sqrt(self.m2 / (self.count - 1)), np.nan)
+        return(average - sd*1.96, average + sd*1.96)
+
+    def scores(self):
+        lower, upper = self.bounds()
+        speed, variability = np.full(len(scoring_conditions), np.nan), np.full(len(scoring_conditions), np.nan)
+        for condition, rt in enumerate(self.rt):
+            rt = np.array(rt)
+            rt = rt[~(np.greater(rt, upper[condition]) | np.less(rt, lower[condition]))]
+            if len(rt) > 0:
+                speed[condition] = rt.mean()
+            if len(rt) > 1:
+                variability[condition] = rt.std(ddof=1)
+        rt = dict(zip(scoring_conditions, speed))
+
+        scores = {"Speed_Core": rt["Core"],
+                  "Speed_Core_Variability": variability[0],
+                  "Speed_Response_Selection_Effect": rt["Response_Selection"] - rt["Core"],
+                  "Speed_Inhibition_Effect": rt["Neutral"] - rt["Response_Selection"],
+                  "Speed_Congruence_Effect": rt["Congruent"] - rt["Neutral"],
+                  "Speed_Incongruence_Effect": rt["Incongruent"] - rt["Neutral"]}
+
+        # Errors (by trial type: Go, Unavailable, Inhibition, Double)
+        errors, trials = self.errors, self.trials
+        with np.errstate(invalid="ignore", divide="ignore"):
+            scores["Errors_Total"] = errors[1:].sum() / trials.sum()
+            scores["Errors_Orientation"] = errors[1:, 0].sum() / trials[1:, 0].sum()
+            scores["Errors_Response_Selection"] = errors[:, [1, 3]].sum() / trials[:, [1, 3]].sum()
+            scores["Errors_Inhibition"] = errors[:, [2, 3]].sum() / trials[:, [2, 3]].sum()
+
+            # IES: Inverse Efficiency Score
+            for name in ["Neutral", "Congruent", "Incongruent"]:
+                condition = scoring_conditions.index(name)
+                scores["IES_" + name] = rt[name]/(1-errors[condition, 0]/trials[condition, 0])
+                scores["IES_" + name + "_log"] = np.log(scores["IES_" + name])
+        return(scores)
+
+
+
+def masked_moments(rt, mask):
+    """
+    Mean and SD (ddof=1) of the masked RTs of each row.
+    """
+    count = mask.sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        average = np.where(mask, rt, 0).sum(axis=1) / count
+        sd = np.sqrt(np.where(mask, (rt - average[:, None])**2, 0).sum(axis=1) / (count - 1))
+    return(average, sd)
+
+
+
+def array_scores(rt, correct, condition, trial_type, scored):
+    """
+    The session scores of processing() for many sessions at once. Each argument has a shape of
+    (sessions, trials): condition and trial_type are codes into scoring_conditions and trial_types
+    (-1 for trials outside the scored conditions), and scored marks the correct trials with an
+    expected response.
+    """
+    rt = np.asarray(rt, dtype=float)
+    errors = np.asarray(correct) == False
+    included = condition >= 0
+    scored = scored & included & ~np.isnan(rt)
+
+    # Speed, without the outliers of each condition
+    speed = {}
+    for code, name in enumerate(scoring_conditions):
+        trials = scored & (condition == code)
+        average, sd = masked_moments(rt, trials)
+        with np.errstate(invalid="ignore"):
+            outliers = (rt > (average + sd*1.96)[:, None]) | (rt < (average - sd*1.96)[:, None])
+        speed[name] = masked_moments(rt, trials & ~outliers)
+    rt = {name: speed[name][0] for name in scoring_conditions}
+
+    scores = {"Speed_Core": rt["Core"],
+              "Speed_Core_Variability": speed["Core"][1],
+              "Speed_Response_Selection_Effect": rt["Response_Selection"] - rt["Core"],
+              "Speed_Inhibition_Effect": rt["Neutral"] - rt["Response_Selection"],
+              "Speed_Congruence_Effect": rt["Congruent"] - rt["Neutral"],
+              "Speed_Incongruence_Effect": rt["Incongruent"] - rt["Neutral"]}
+
+    # Errors
+    go = included & (trial_type == 0)
+    unavailable = included & ((trial_type == 1) | (trial_type == 3))
+    inhibition = included & (trial_type >= 2)
+    conditional = included & (condition > 0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        scores["Errors_Total"] = (errors & conditional).sum(axis=1) / included.sum(axis=1)
+        scores["Errors_Orientation"] = (errors & go & conditional).sum(axis=1) / (go & conditional).sum(axis=1)
+        scores["Errors_Response_Selection"] = (errors & unavailable).sum(axis=1) / unavailable.sum(axis=1)
+        scores["Errors_Inhibition"] = (errors & inhibition).sum(axis=1) / inhibition.sum(axis=1)
+
+        # IES: Inverse Efficiency Score
+        for name in ["Neutral", "Congruent", "Incongruent"]:
+            trials = go & (condition == scoring_conditions.index(name))
+            scores["IES_" + name] = rt[name]/(1-(errors & trials).sum(axis=1)/trials.sum(axis=1))
+            scores["IES_" + name + "_log"] = np.log(scores["IES_" + name])
+    return(pd.DataFrame(scores))
@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+"""
+Cognitive Control Task: trial sequences.
+Authors: Makowski et al. (under review)
+Copyright: The Neuropsydia Development Team
+Site: https://github.com/DominiqueMakowski/CoCon.py
+"""
+
+import zlib
+
+import numpy as np
+import pandas as pd
+
+#==============================================================================
+# Initialization
+#==============================================================================
+# Categories of the coded columns of a sequence table
+categories = {"Global_Shape": ["circle", "global"],
+              "Global_Color": ["red", "yellow", "blue", "white"],
+              "Local_Shape": ["local"],
+              "Local_Color": ["red", "yellow", "blue", "white"],
+              "Conflict": ["Neutral", "Congruent", "Incongruent"],
+              "Response": ["DOWN", "RIGHT", "LEFT", "NA"]}
+
+# Columns filled in by run_trials(), with their type and empty value
+result_columns = {"Order": (np.int32, 0),
+                  "Time_Trial_Onset": ("datetime64[us]", "NaT"),
+                  "Prestimulus_Interval": (np.float64, np.nan),
+                  "Time_Stimulus_Onset": ("datetime64[us]", "NaT"),
+                  "Response": (np.int8, categories["Response"].index("NA")),
+                  "RT": (np.float64, np.nan),
+                  "Prestimulus_Overshoot": (np.float64, np.nan),
+                  "Onset_Error": (np.float64, np.nan),
+                  "Draw_Duration": (np.float64, np.nan),
+                  "Refresh_Duration": (np.float64, np.nan),
+                  "Response_Latency": (np.float64, np.nan),
+                  "Response_Offset": (np.float64, np.nan),
+                  "Anticipations": (np.float64, np.nan),
+                  "Anticipation_Time": (np.float64, np.nan)}
+
+# Response_Correct and Global_Angle as a function of Local_Angle
+conditional_responses = {-90:-90, 0:0, 90:90, 180:"NA"}
+no_responses = {-90:"NA", 0:"NA", 90:"NA", 180:"NA"}
+upright = {-90:0, 0:0, 90:0, 180:0}
+congruent = {-90:-90, 0:0, 90:90, 180:180}
+incongruent = {-90:90, 0:180, 90:-90, 180:0}
+
+
+#==============================================================================
+# Blocks
+#==============================================================================
+def trial_kind(count, global_shape="circle", global_colors=("red", "yellow", "blue"), local_colors=("red", "yellow", "blue"),
+               local_angles=(-90, 0, 90), global_angles=upright, responses=conditional_responses,
+               inhibition=False, availability=True, conflict="Neutral"):
+    """
+    A kind of trial: how many there are in the block, and the pools their colors and local angle are drawn from.
+    The global angle (congruence rule) and expected response follow from the local angle.
+    """
+    return({"Count": count, "Global_Shape": global_shape, "Global_Color": list(global_colors), "Local_Color": list(local_colors),
+            "Local_Angle": list(local_angles), "Global_Angle": global_angles, "Response_Correct": responses,
+            "Inhibition": inhibition, "Response_Availability": availability, "Conflict": conflict})
+
+
+
+def conflict_kinds(conflict, global_angles):
+    """
+    Go, no-response, no-go and double trials of one half of the conflict block.
+    """
+    return([trial_kind(40, "global", global_angles=global_angles, conflict=conflict),
+            trial_kind(3, "global", local_angles=[180], global_angles=global_angles, availability=False, conflict=conflict),
+            trial_kind(6, "global", ["white"], global_angles=global_angles, responses=no_responses, inhibition=True, conflict=conflict),
+            trial_kind(3, "global", ["white"], local_angles=[180], global_angles=global_angles, inhibition=True, availability=False, conflict=conflict)])
+
+
+# The four blocks of procedure(), as the trial kinds they are shuffled from
+blocks = [
+    {"Condition_Response_Selection": "None", "Condition_Inhibition": False, "Condition_Conflict": False,
+     "Trials": [trial_kind(30, global_colors=categories["Global_Color"], local_colors=categories["Local_Color"], local_angles=[-90, 0, 90, 180], responses=upright)]},
+    {"Condition_Response_Selection": "Conditional", "Condition_Inhibition": False, "Condition_Conflict": False,
+     "Trials": [trial_kind(30, global_colors=categories["Global_Color"], local_colors=categories["Local_Color"]),
+                trial_kind(3, global_colors=categories["Global_Color"], local_colors=categories["Local_Color"], local_angles=[180], availability=False)]},
+    {"Condition_Response_Selection": "Conditional", "Condition_Inhibition": True, "Condition_Conflict": False,
+     "Trials": [trial_kind(40),
+                trial_kind(3, local_angles=[180], availability=False),
+                trial_kind(6, global_colors=["white"], responses=no_responses, inhibition=True),
+                trial_kind(3, global_colors=["white"], local_angles=[180], inhibition=True, availability=False)]},
+    {"Condition_Response_Selection": "Conditional", "Condition_Inhibition": True, "Condition_Conflict": True,
+     "Trials": conflict_kinds("Incongruent", incongruent) + conflict_kinds("Congruent", congruent)}]
+
+
+
+#==============================================================================
+# Compiler
+#==============================================================================
+def level_picks(levels, shape, rng, balanced=False):
+    """
+    Indices of the levels of an attribute for shape trials: drawn independently, or balanced (each
+    level as often as the others, give or take one, the extra ones at random).
+    """
+    if balanced is False:
+        return(rng.integers(levels, size=shape))
+    permutations = np.argsort(rng.random((shape[0], levels)), axis=1)
+    # In random positions, so that the attributes of a trial are not tied to each other
+    picks = permutations[:, np.arange(shape[1]) % levels]
+    return(np.take_along_axis(picks, np.argsort(rng.random(shape), axis=1), axis=1))
+
+
+
+def sequence_table(block, n=1, rng=None, balanced=False):
+    """
+    Draw n shuffled sequences of a block at once, as columns of shape (n, trials).
+    Coded columns index into categories, and a missing Response_Correct ("NA") is NaN.
+    rng can be a numpy Generator or a seed. With balanced, the colors and local angles of each kind
+    of trial are balanced (see level_picks()).
+    """
+    rng = np.random.default_rng(rng)
+
+    table = {condition: block[condition] for condition in ["Condition_Response_Selection", "Condition_Inhibition", "Condition_Conflict"]}
+    columns = {"Global_Shape": [], "Global_Color": [], "Global_Angle": [], "Local_Shape": [], "Local_Color": [], "Local_Angle": [],
+               "Inhibition": [], "Conflict": [], "Response_Availability": [], "Response_Correct": []}
+    for kind in block["Trials"]:
+        shape = (n, kind["Count"])
+        pick = level_picks(len(kind["Local_Angle"]), shape, rng, balanced)
+        columns["Local_Angle"].append(np.array(kind["Local_Angle"])[pick])
+        columns["Global_Angle"].append(np.array([kind["Global_Angle"][angle] for angle in kind["Local_Angle"]])[pick])
+        columns["Response_Correct"].append(np.array([np.nan if kind["Response_Correct"][angle] == "NA" else kind["Response_Correct"][angle] for angle in kind["Local_Angle"]], dtype=float)[pick])
+        for column in ["Global_Color", "Local_Color"]:
+            codes = np.array([categories[column].index(color) for color in kind[column]], dtype=np.int8)
+            columns[column].append(codes[level_picks(len(codes), shape, rng, balanced)])
+        columns["Global_Shape"].append(np.full(shape, categories["Global_Shape"].index(kind["Global_Shape"]), dtype=np.int8))
+        columns["Local_Shape"].append(np.zeros(shape, dtype=np.int8))
+        columns["Conflict"].append(np.full(shape, categories["Conflict"].index(kind["Conflict"]), dtype=np.int8))
+        columns["Inhibition"].append(np.full(shape, kind["Inhibition"]))
+        columns["Response_Availability"].append(np.full(shape, kind["Response_Availability"]))
+
+    # Shuffle each sequence independently
+    shuffle = np.argsort(rng.random((n, sum(kind["Count"] for kind in block["Trials"]))), axis=1)
+    for column, values in columns.items():
+        table[column] = np.take_along_axis(np.concatenate(values, axis=1), shuffle, axis=1)
+    table["Global_Angle"] = table["Global_Angle"].astype(np.int16)
+    table["Local_Angle"] = table["Local_Angle"].astype(np.int16)
+    return(table)
+
+
+
+
+def sequence_trials(table, row=0):
+    """
+    One sequence of a table as the columns of the trials returned by trial_sequence().
+    """
+    trials = {}
+    for column, values in table.items():
+        if isinstance(values, np.ndarray) is False:
+            trials[column] = np.full(table["Local_Angle"].shape[1], values)
+        elif column in categories:
+            trials[column] = np.array(categories[column], dtype=object)[values[row]]
+        elif column == "Response_Correct":
+            trials[column] = np.array([int(angle) if np.isnan(angle) == False else "NA" for angle in values[row]], dtype=object)
+        else:
+            trials[column] = values[row]
+    return(trials)
+
+
+
+def block_codes(table):
+    """
+    Scoring condition (see scoring.scoring_conditions) and trial type (see scoring.trial_types)
+    codes of each trial of a sequence table or trial store.
+    """
+    if table["Condition_Response_Selection"] == "None":
+        condition = np.zeros(table["Conflict"].shape, dtype=np.int8)
+    elif table["Condition_Conflict"] is False:
+        condition = np.full(table["Conflict"].shape, 2 if table["Condition_Inhibition"] else 1, dtype=np.int8)
+    else:
+        condition = np.array([-1, 3, 4], dtype=np.int8)[table["Conflict"]]
+    trial_type = np.where(table["Response_Availability"], 0, 1) + np.where(table["Inhibition"], 2, 0)
+    return(condition, trial_type)
+
+
+
+def expected_responses(table):
+    """
+    Response code of a correct answer: the key pointed at by Response_Correct, or none.
+    """
+    responses = categories["Response"]
+    keys = np.array([responses.index(key) for key in ["LEFT", "DOWN", "RIGHT"]], dtype=np.int8)
+    angles = np.nan_to_num(table["Response_Correct"]).astype(int)
+    return(np.where(np.isnan(table["Response_Correct"]), responses.index("NA"), keys[(angles + 90) // 90]).astype(np.int8))
+
+
+
+def interleave(trials, rng=None):
+    """
+    Reorder a trial store so that each kind of trial (scoring condition and trial type) is spread
+    evenly over the block: the first k trials then hold every kind in proportion, give or take one.
+    """
+    rng = np.random.default_rng(rng)
+    condition, trial_type = block_codes(trials)
+    strata = condition.astype(int)*4 + trial_type
+    # Jittered rank of each trial within its kind, as a fraction of the kind
+    key = np.empty(len(strata))
+    for stratum in np.unique(strata):
+        members = np.flatnonzero(strata == stratum)
+        key[members] = (rng.permutation(len(members)) + rng.random(len(members))) / len(members)
+    order = np.argsort(key, kind="stable")
+    return({column: values[order] if isinstance(values, np.ndarray) else values for column, values in trials.items()})
+
+
+
+#==============================================================================
+# Sequence
+#==============================================================================
+def block_spec(response_selection="None", inhibition=False, conflict=False):
+    """
+    The block of blocks run with these conditions.
+    """
+    for block in blocks:
+        if (block["Condition_Response_Selection"], block["Condition_Inhibition"], block["Condition_Conflict"]) == (response_selection, inhibition, conflict):
+            return(block)
+    raise ValueError("CoCon: no block with response_selection=" + str(response_selection) + ", inhibition=" + str(inhibition) + " and conflict=" + str(conflict) + ".")
+
+
+
+def participant_rng(participant_id, seed=0):
+    """
+    Random generator giving the same sequences to a participant for a given seed.
+    """
+    return(np.random.default_rng([seed, zlib.crc32(str(participant_id).encode("utf-8"))]))
+
+
+
+def trial_sequence(response_selection="None", inhibition=False, conflict=False, rng=None):
+    """
+    Trials of a block, in presentation order, drawn from rng (a numpy Generator or a seed).
+    """
+    trials = sequence_trials(sequence_table(block_spec(response_selection, inhibition, conflict), 1, rng))
+    trials = {column: values.tolist() for column, values in trials.items()}
+    return([dict(zip(trials.keys(), values)) for values in zip(*trials.values())])
+
+
+
+def trial_store(response_selection="None", inhibition=False, conflict=False, rng=None, table=None):
+    """
+    Trials of a block as typed columns (see sequence_table()), with the columns of run_trials() preallocated.
+    The sequence is drawn at random from table if given (e.g., a pool of schedules, see schedules.py).
+    """
+    rng = np.random.default_rng(rng)
+    if table is None:
+        table, row = sequence_table(block_spec(response_selection, inhibition, conflict), 1, rng), 0
+    else:
+        row = rng.integers(table["Local_Angle"].shape[0])
+    table = {column: values[row].copy() if isinstance(values, np.ndarray) else values for column, values in table.items()}
+    for column, (dtype, empty) in result_columns.items():
+        table[column] = np.full(len(table["Local_Angle"]), empty, dtype=dtype)
+    return(table)
+
+
+
+def trial_frame(table, row=None):
+    """
+    DataFrame over the columns of a trial store (or of one row of a sequence table), with the coded
+    columns as categoricals and missing responses as missing values.
+    """
+    columns = {}
+    for column, values in table.items():
+        if isinstance(values, np.ndarray) and values.ndim == 2:
+            values = values[0 if row is None else row]
+        if column == "Response":
+            # No response is a missing value, as statistics() stores it
+            values = np.where(values == categories[column].index("NA"), -1, values)
+            values = pd.Categorical.from_codes(values, categories=categories[column][:-1])
+        elif column in categories:
+            values = pd.Categorical.from_codes(values, categories=categories[column])
+        elif column == "Response_Correct":
+            values = pd.array(values, dtype="Int16")
+        columns[column] = values
+    return(pd.DataFrame(columns, index=pd.RangeIndex(table["Local_Angle"].shape[-1]), copy=False))
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+Cognitive Control Task: simulation of synthetic participants.
+Authors: Makowski et al. (under review)
+Copyright: The Neuropsydia Development Team
+Site: https://github.com/DominiqueMakowski/CoCon.py
+"""
+
+import numpy as np
+import pandas as pd
+
+import scoring
+import sequences
+
+#==============================================================================
+# Initialization
+#==============================================================================
+# Shift of the mean RT (ms) in each scoring condition
+condition_effects = {"Core": 0, "Response_Selection": 100, "Neutral": 130, "Congruent": 120, "Incongruent": 170}
+# Probability of an error for each trial type
+error_rates = {"Go": 0.05, "Unavailable": 0.10, "Inhibition": 0.20, "Double": 0.10}
+time_max = 1750
+
+
+#==============================================================================
+# Simulation
+#==============================================================================
+def simulate(n_participants=1, seed=None, rt_mu=450, rt_sigma=50, rt_tau=100, participant_sd=50,
+             effects=None, errors=None):
+    """
+    Simulate the four blocks of n participants at once.
+
+    RTs follow an ex-Gaussian distribution (mu, sigma, tau), whose mu is shifted for each participant
+    (participant_sd) and each scoring condition (effects, see condition_effects). Errors occur with the
+    probability of their trial type (errors, see error_rates): a wrong or missing key on go trials, a key
+    press on the others. Responses slower than time_max are missed.
+
+    Returns the sequence tables of the blocks, with the Response (coded) and RT columns added.
+    """
+    effects = dict(condition_effects, **(effects or {}))
+    errors = dict(error_rates, **(errors or {}))
+    rng = np.random.default_rng(seed)
+    mu = rt_mu + participant_sd*rng.standard_normal((n_participants, 1))
+
+    responses = sequences.categories["Response"]
+    keys = np.array([responses.index(key) for key in ["LEFT", "DOWN", "RIGHT"]], dtype=np.int8)
+    shift = np.array([effects[name] for name in scoring.scoring_conditions] + [0])
+    error_rate = np.array([errors[name] for name in scoring.trial_types])
+
+    tables = []
+    for block in sequences.blocks:
+        table = sequences.sequence_table(block, n_participants, rng)
+        condition, trial_type = sequences.block_codes(table)
+        shape = condition.shape
+
+        expected = sequences.expected_responses(table)
+        error = rng.random(shape) < error_rate[trial_type]
+        # Wrong answers: one of the other keys (or none) on go trials, any key otherwise
+        wrong = np.where(expected == responses.index("NA"), keys[rng.integers(3, size=shape)],
+                         (expected + rng.integers(1, 4, size=shape)) % 4)
+        response = np.where(error, wrong, expected).astype(np.int8)
+
+        rt = mu + shift[condition] + rng.normal(0, rt_sigma, shape) + rng.exponential(rt_tau, shape)
+        response[rt > time_max] = responses.index("NA")
+        table["Response"] = response
+        table["RT"] = np.where(response == responses.index("NA"), np.nan, rt)
+        table["Order"] = np.broadcast_to(np.arange(1, shape[1]+1), shape)
+        tables.append(table)
+    return(tables)
+
+
+
+#==============================================================================
+# Scoring
+#==============================================================================
+def simulated_scores(tables):
+    """
+    processing() scores of every simulated participant (see scoring.array_scores()).
+    """
+    rt, correct, condition, trial_type, scored = [], [], [], [], []
+    for table in tables:
+        codes = sequences.block_codes(table)
+        condition.append(codes[0])
+        trial_type.append(codes[1])
+        expected = sequences.expected_responses(table)
+        rt.append(table["RT"])
+        correct.append(table["Response"] == expected)
+        scored.append((table["Response"] == expected) & ~np.isnan(table["Response_Correct"]))
+    return(scoring.array_scores(*[np.concatenate(values, axis=1) for values in [rt, correct, condition, trial_type, scored]]))
+
+
+
+def simulated_session(tables, participant=0):
+    """
+    The blocks of one simulated participant as processing() expects them.
+    """
+    return([scoring.statistics(sequences.trial_frame(table, participant)) for table in tables])
+
+
+
+def simulate_scores(n_participants, chunk_size=10000, seed=None, **kwargs):
+    """
+    Scores of many simulated participants, simulated by chunks to bound memory.
+    """
+    rng = np.random.default_rng(seed)
+    scores = []
+    for start in range(0, n_participants, chunk_size):
+        tables = simulate(min(chunk_size, n_participants-start), seed=rng, **kwargs)
+        scores.append(simulated_scores(tables))
+    return(pd.concat(scores, ignore_index=True))
@@ -0,0 +1,381 @@
+# -*- coding: utf-8 -*-
+"""
+Cognitive Control Task: stimuli.
+Authors: Makowski et al. (under review)
+Copyright: The Neuropsydia Development Team
+Site: https://github.com/DominiqueMakowski/CoCon.py
+"""
+
+import argparse
+import bisect
+import collections
+import collections.abc
+import concurrent.futures
+import glob
+import hashlib
+import json
+import math
+import os
+import sys
+import threading
+
+import numpy as np
+
+import sequences
+import tracing
+
+#==============================================================================
+# Initialization
+#==============================================================================
+stimuli_path = "./Stimuli/"
+stimuli_size = 8
+atlas_magic = b"COCONATLAS1"
+
+
+#==============================================================================
+# Cache
+#==============================================================================
+def image_size(image):
+    """
+    Memory taken by a loaded image (bytes).
+    """
+    if hasattr(image, "get_bytesize"):
+        return(image.get_bytesize() * image.get_width() * image.get_height())
+    return(sys.getsizeof(image))
+
+
+
+class StimulusCache(collections.abc.MutableMapping):
+    """
+    Cache of the stimuli, to be passed to n.image() and n.preload(). Each trial draws a composite of
+    its stimuli. Once a block is prepared (see prepare()), the composites of its next trials are
+    made ahead in the background, as far as the memory budget (bytes) allows. Once over the budget,
+    the composites needed the latest (or no more) are dropped first, never the one being shown.
+    """
+    def __init__(self, display, budget=128*1024**2, atlas=None):
+        self.display = display
+        self.budget = budget
+        self.atlas = atlas
+        self.memory = 0
+        self.images = collections.OrderedDict()
+        self.sizes = {}
+        # Composites of the trials of the block, the trials each is shown at, and the next trial
+        self.plan = []
+        self.uses = {}
+        self.stimuli = {}
+        self.components = {}
+        self.position = 0
+        self.current = None
+        self.filling = None
+        self.lock = threading.RLock()
+        self.loading = threading.Lock()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+    def __getitem__(self, key):
+        with self.lock:
+            image = self.images[key]
+            self.images.move_to_end(key)
+            return(image)
+
+    def __setitem__(self, key, image):
+        with self.lock:
+            if key in self.images:
+                del self[key]
+            self.images[key] = image
+            self.sizes[key] = image_size(image)
+            self.memory += self.sizes[key]
+            # Keep at least the image just added, and the one being shown
+            while self.memory > self.budget:
+                others = [old for old in self.images if old != key and old != self.current]
+                if len(others) == 0:
+                    break
+                del self[max(others, key=self.next_use)]
+
+    def __delitem__(self, key):
+        with self.lock:
+            del self.images[key]
+            self.memory -= self.sizes.pop(key)
+
+    def __iter__(self):
+        return(iter(list(self.images)))
+
+    def __len__(self):
+        return(len(self.images))
+
+    def key(self, file, rotate=0, size=stimuli_size, path=stimuli_path, extension=".png"):
+        # Same key as n.image() uses to look into its cache
+        return(path + file + '_' + str(size) + '_n_height_' + str(rotate) + '_100_' + str(self.display.monitor_diagonal) + '_' + extension)
+
+    def next_use(self, key):
+        """
+        The next trial of the block that shows a composite (infinite if none).
+        """
+        uses = self.uses.get(key, [])
+        index = bisect.bisect_left(uses, self.position)
+        return(uses[index] if index < len(uses) else math.inf)
+
+    def pixels(self, file, rotate=0, size=stimuli_size):
+        """
+        RGBA pixels of a stimulus, from the atlas if it has them.
+        """
+        if self.atlas is not None and (file, rotate, size) in self.atlas:
+            return(self.atlas.array(file, rotate, size))
+        return(render(file, rotate, size, self.display.screen_height))
+
+    def make(self, key, stimuli):
+        """
+        Make sure the composite of (file, rotate) stimuli is in the cache (waiting for it if it is
+        being made in the background).
+        """
+        with self.loading:
+            if key not in self.images:
+                with tracing.span("Compose", "stimuli", stimulus=composite_name(stimuli)):
+                    for stimulus in stimuli:
+                        if stimulus not in self.components:
+                            self.components[stimulus] = self.pixels(*stimulus)
+                    self[key] = surface(composite([self.components[stimulus] for stimulus in stimuli]))
+
+    def compose(self, stimuli):
+        """
+        Make sure the composite of (file, rotate) stimuli, drawn over one another, is in the cache,
+        and move on to the trial after it. Returns its name, to display it with n.image() in a
+        single blit.
+        """
+        stimuli = tuple(stimuli)
+        name = composite_name(stimuli)
+        key = self.key(name)
+        with self.lock:
+            self.current = key
+            uses = self.uses.get(key, [])
+            index = bisect.bisect_left(uses, self.position)
+            if index < len(uses):
+                self.position = uses[index] + 1
+            if key in self.images:
+                self.images.move_to_end(key)
+        self.make(key, stimuli)
+        self.ahead()
+        return(name)
+
+    def prepare(self, trial_stimuli):
+        """
+        Plan the composites of the trials of a block, and start making them ahead in the background.
+        """
+        with self.lock:
+            self.plan = [self.key(composite_name(stimuli)) for stimuli in trial_stimuli]
+            self.uses = {}
+            for position, key in enumerate(self.plan):
+                self.uses.setdefault(key, []).append(position)
+            self.stimuli = {key: tuple(stimuli) for key, stimuli in zip(self.plan, trial_stimuli)}
+            self.components = {}
+            self.position = 0
+            self.current = None
+        return([self.ahead()])
+
+    def ahead(self):
+        with self.lock:
+            if self.filling is None:
+                self.filling = self.executor.submit(self.fill)
+            return(self.filling)
+
+    def fill(self):
+        """
+        Make the composites of the next trials, in order, until the next one would only fit by
+        dropping a composite needed sooner.
+        """
+        while True:
+            with self.lock:
+                upcoming = [key for key in self.plan[self.position:] if key not in self.images]
+                if len(upcoming) == 0:
+                    self.filling = None
+                    return
+                key = upcoming[0]
+                needed = self.next_use(key)
+                # Memory free, or held by composites needed later (or no more)
+                room = self.budget - self.memory + sum(self.sizes[old] for old in self.images if old != self.current and self.next_use(old) > needed)
+                if len(self.sizes) > 0 and room < max(self.sizes.values()):
+                    self.filling = None
+                    return
+                stimuli = self.stimuli[key]
+            self.make(key, stimuli)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+
+
+def composite_name(stimuli):
+    """
+    Name of the composite of (file, rotate) stimuli, as n.image() is given it.
+    """
+    return("+".join(file + "_" + str(rotate) for file, rotate in stimuli))
+
+
+
+def composite(layers):
+    """
+    RGBA layers alpha-composited over one another, as they would be by successive blits.
+    """
+    import PIL.Image
+    image = PIL.Image.fromarray(np.ascontiguousarray(layers[0]))
+    for layer in layers[1:]:
+        image = PIL.Image.alpha_composite(image, PIL.Image.fromarray(np.ascontiguousarray(layer)))
+    return(np.asarray(image))
+
+
+
+def surface(pixels):
+    """
+    Pygame surface (a copy) of RGBA pixels.
+    """
+    import pygame
+    return(pygame.image.fromstring(np.ascontiguousarray(pixels).tobytes(), (pixels.shape[1], pixels.shape[0]), "RGBA"))
+
+
+
+def trial_stimuli(trials):
+    """
+    The (file, rotate) global and local stimuli of each trial of a trial store.
+    """
+    categories = sequences.categories
+    stimuli = []
+    for order in range(len(trials["Local_Angle"])):
+        stimuli.append([(categories["Global_Color"][trials["Global_Color"][order]] + "_" + categories["Global_Shape"][trials["Global_Shape"][order]], int(trials["Global_Angle"][order])),
+                        (categories["Local_Color"][trials["Local_Color"][order]] + "_" + categories["Local_Shape"][trials["Local_Shape"][order]], int(trials["Local_Angle"][order]))])
+    return(stimuli)
+
+
+
+
+#==============================================================================
+# Atlas
+#==============================================================================
+def atlas_variants(size=stimuli_size):
+    """
+    Every (file, rotate, size) stimulus that run_trials() can display.
+    """
+    variants = set()
+    for block in sequences.blocks:
+        for kind in block["Trials"]:
+            for angle in kind["Local_Angle"]:
+                for color in kind["Global_Color"]:
+                    variants.add((color + "_" + kind["Global_Shape"], kind["Global_Angle"][angle], size))
+                for color in kind["Local_Color"]:
+                    variants.add((color + "_local", angle, size))
+    return(sorted(variants))
+
+
+
+def atlas_hash(screen_height, variants, path=stimuli_path, extension=".png"):
+    """
+    Hash of the source images and of what is rendered from them.
+    """
+    digest = hashlib.sha256()
+    for file in sorted(set(variant[0] for variant in variants)):
+        with open(os.path.join(path, file + extension), "rb") as image:
+            digest.update(file.encode("utf-8") + image.read())
+    digest.update(json.dumps([screen_height, variants]).encode("utf-8"))
+    return(digest.hexdigest())
+
+
+
+def atlas_filename(screen_height, variants=None, path=stimuli_path):
+    if variants is None:
+        variants = atlas_variants()
+    return(os.path.join(path, "CoCon_" + atlas_hash(screen_height, variants, path)[:16] + ".atlas"))
+
+
+
+def render(file, rotate, size, screen_height, path=stimuli_path, extension=".png"):
+    """
+    Scale and rotate a stimulus as n.preload() does, as an RGBA array.
+    """
+    import PIL.Image
+    image = PIL.Image.open(os.path.join(path, file + extension), "r")
+    w, h = image.size
+    image = image.resize((int(w/h*size*screen_height/20.0), int(size*screen_height/20.0)), PIL.Image.LANCZOS)
+    image = image.rotate(rotate).convert("RGBA")
+    return(np.asarray(image))
+
+
+
+def build_atlas(screen_height, path=stimuli_path, variants=None):
+    """
+    Render all the variants once into a single file: a header (JSON index of the images) followed
+    by their raw RGBA pixels. Atlases are named after the hash of their sources, so that a change
+    in the images (or in the screen height) is never served from a stale atlas.
+    """
+    if variants is None:
+        variants = atlas_variants()
+    filename = atlas_filename(screen_height, variants, path)
+
+    images = [render(file, rotate, size, screen_height, path) for file, rotate, size in variants]
+    index, offset = [], 0
+    for (file, rotate, size), image in zip(variants, images):
+        index.append([file, rotate, size, offset, image.shape[1], image.shape[0]])
+        offset += image.nbytes
+    header = json.dumps({"hash": atlas_hash(screen_height, variants, path), "screen_height": screen_height, "images": index}).encode("utf-8")
+    # Pixels start on a page boundary
+    start = -(-(len(atlas_magic) + 8 + len(header)) // 4096) * 4096
+
+    with open(filename + ".tmp", "wb") as atlas:
+        atlas.write(atlas_magic + len(header).to_bytes(8, "little") + header)
+        atlas.write(b"\0" * (start - atlas.tell()))
+        for image in images:
+            atlas.write(np.ascontiguousarray(image).tobytes())
+    os.replace(filename + ".tmp", filename)
+    for old in glob.glob(os.path.join(path, "CoCon_*.atlas")):
+        if old != filename:
+            os.remove(old)
+    return(filename)
+
+
+
+class Atlas():
+    """
+    Stimuli of an atlas file, mapped in memory. Their pixels are read in place to be composited
+    (the composites themselves are copies, held by the StimulusCache).
+    """
+    def __init__(self, filename):
+        with open(filename, "rb") as atlas:
+            if atlas.read(len(atlas_magic)) != atlas_magic:
+                raise ValueError("CoCon: " + filename + " is not a stimuli atlas.")
+            length = int.from_bytes(atlas.read(8), "little")
+            header = json.loads(atlas.read(length).decode("utf-8"))
+        start = -(-(len(atlas_magic) + 8 + length) // 4096) * 4096
+        self.pixels = np.memmap(filename, dtype=np.uint8, mode="r", offset=start)
+        self.images = {(file, rotate, size): (offset, width, height) for file, rotate, size, offset, width, height in header["images"]}
+
+    def __contains__(self, variant):
+        return(variant in self.images)
+
+    def array(self, file, rotate, size=stimuli_size):
+        offset, width, height = self.images[(file, rotate, size)]
+        return(self.pixels[offset:offset + width*height*4].reshape(height, width, 4))
+
+
+
+def load_atlas(screen_height, path=stimuli_path):
+    """
+    The atlas built for these stimuli and this screen height, or None if there is none.
+    """
+    filename = atlas_filename(screen_height, path=path)
+    if os.path.isfile(filename) is False:
+        return(None)
+    return(Atlas(filename))
+
+
+
+#==============================================================================
+# Run
+#==============================================================================
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Build the atlas of pre-rendered stimuli for a testing station.")
+    parser.add_argument("--height", type=int, required=True, help="Screen height of the station (pixels).")
+    parser.add_argument("--path", default=stimuli_path, help="Folder of the stimuli.")
+    args = parser.parse_args(args)
+    filename = build_atlas(args.height, path=args.path)
+    print("CoCon: stimuli atlas written to " + filename)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+Cognitive Control Task: columnar (Parquet or Feather) session files.
+Authors: Makowski et al. (under review)
+Copyright: The Neuropsydia Development Team
+Site: https://github.com/DominiqueMakowski/CoCon.py
+
+Each session is split into a trials table (one row per trial, with coded factors) and a summary
+table (one row per session, with the scores), both keyed by Participant_ID and Experiment_Start.
+Both formats require pyarrow.
+"""
+
+import glob
+import os
+
+import numpy as np
+import pandas as pd
+
+import sequences
+
+#==============================================================================
+# Initialization
+#==============================================================================
+formats = {"parquet": ".parquet", "feather": ".feather"}
+# Columns constant within a session
+session_columns = ["Participant_ID", "Experiment_Start", "Experiment_End", "Version", "Experiment_Duration"]
+score_columns = ["Speed_Core", "Speed_Core_Variability", "Speed_Response_Selection_Effect", "Speed_Inhibition_Effect",
+                 "Speed_Congruence_Effect", "Speed_Incongruence_Effect",
+                 "Errors_Total", "Errors_Orientation", "Errors_Response_Selection", "Errors_Inhibition",
+                 "IES_Neutral", "IES_Neutral_log", "IES_Congruent", "IES_Congruent_log", "IES_Incongruent", "IES_Incongruent_log"]
+key_columns = ["Participant_ID", "Experiment_Start"]
+# Stimulus factors and their levels (missing responses are missing values)
+factors = {"Condition_Response_Selection": ["None", "Conditional"],
+           "Global_Shape": sequences.categories["Global_Shape"],
+           "Global_Color": sequences.categories["Global_Color"],
+           "Local_Shape": sequences.categories["Local_Shape"],
+           "Local_Color": sequences.categories["Local_Color"],
+           "Conflict": sequences.categories["Conflict"],
+           "Response": sequences.categories["Response"][:-1],
+           "Response_Correct_Orientation": ["LEFT", "RIGHT", "DOWN", "UP"]}
+small_columns = {"Global_Angle": "int16", "Local_Angle": "int16", "Response_Correct": "Int16",
+                 "Order": "int16", "Correct": "int8"}
+
+
+#==============================================================================
+# Tables
+#==============================================================================
+def check_format(data_format):
+    """
+    Fail before the session, rather than at saving, if the format cannot be written.
+    """
+    if data_format not in formats:
+        raise ValueError("CoCon: data_format must be one of " + ", ".join(formats) + ".")
+    try:
+        import pyarrow
+    except ImportError:
+        raise ImportError("CoCon: saving as " + data_format + " requires pyarrow (pip install pyarrow).")
+
+
+
+def session_table(df):
+    """
+    The summary of a processed session: one row with its infos and scores.
+    """
+    columns = [column for column in session_columns + score_columns if column in df.columns]
+    summary = df[columns].iloc[[0]].reset_index(drop=True)
+    summary["Participant_ID"] = summary["Participant_ID"].astype(str)
+    summary["Experiment_Start"] = pd.to_datetime(summary["Experiment_Start"])
+    summary["Version"] = summary["Version"].astype(str)
+    return(summary)
+
+
+
+def trial_table(df):
+    """
+    The trials of a processed session, without the session columns, and with compact dtypes.
+    """
+    trials = df.drop(columns=[column for column in session_columns + score_columns if column in df.columns]).reset_index(drop=True)
+    for column, levels in factors.items():
+        if column in trials.columns:
+            trials[column] = pd.Categorical(trials[column].astype(object).where(trials[column].notnull(), None), categories=levels)
+    for column, dtype in small_columns.items():
+        if column in trials.columns:
+            trials[column] = trials[column].astype(dtype)
+    for column in ["Time_Trial_Onset", "Time_Stimulus_Onset"]:
+        if column in trials.columns:
+            trials[column] = pd.to_datetime(trials[column])
+
+    # Link to the summary
+    trials.insert(0, "Participant_ID", pd.Categorical([str(df["Participant_ID"].iloc[0])]*len(trials)))
+    trials.insert(1, "Experiment_Start", np.repeat(pd.to_datetime(df["Experiment_Start"].iloc[0]), len(trials)))
+    return(trials)
+
+
+
+#==============================================================================
+# Files
+#==============================================================================
+def write_table(table, filename, data_format):
+    if data_format == "parquet":
+        table.to_parquet(filename, index=False)
+    else:
+        table.to_feather(filename)
+
+
+
+def read_table(filename):
+    if filename.endswith(formats["parquet"]):
+        return(pd.read_parquet(filename))
+    return(pd.read_feather(filename))
+
+
+
+def save_session(df, path="./Data/", data_format="parquet"):
+    """
+    Save a processed session as <path>/Trials/ and <path>/Sessions/ files. Returns the file name.
+    """
+    check_format(data_format)
+    summary = session_table(df)
+    name = summary["Participant_ID"][0] + "_" + summary["Experiment_Start"][0].strftime("%Y-%m-%d_%H-%M-%S") + "_CoCon" + formats[data_format]
+    for folder, table in [("Trials", trial_table(df)), ("Sessions", summary)]:
+        if os.path.exists(os.path.join(path, folder)) is False:
+            os.makedirs(os.path.join(path, folder))
+        write_table(table, os.path.join(path, folder, name), data_format)
+    return(name)
+
+
+
+def read_cohort(path="./Data/", trials=True):
+    """
+    The session summaries of a folder (and their trials, unless trials is False), as (sessions, trials).
+    The factors keep their categorical dtypes across sessions.
+    """
+    files = sorted(glob.glob(os.path.join(path, "Sessions", "*_CoCon.*")))
+    if len(files) == 0:
+        raise ValueError("CoCon: no session in " + path + ".")
+    sessions = pd.concat([read_table(filename) for filename in files], ignore_index=True)
+    if trials is False:
+        return(sessions, None)
+
+    tables = [read_table(os.path.join(path, "Trials", os.path.basename(filename))) for filename in files]
+    participants = pd.api.types.union_categoricals([table["Participant_ID"] for table in tables])
+    trials = pd.concat(tables, ignore_index=True)
+    trials["Participant_ID"] = participants
+    return(sessions, trials)
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+Cognitive Control Task: timing instrumentation.
+Authors: Makowski et al. (under review)
+Copyright: The Neuropsydia Development Team
+Site: https://github.com/DominiqueMakowski/CoCon.py
+"""
+
+import datetime
+import time
+
+import numpy as np
+import pandas as pd
+
+#==============================================================================
+# Initialization
+#==============================================================================
+# Per-trial latencies recorded by run_trials() (ms)
+timing_measures = ["Prestimulus_Overshoot", "Onset_Error", "Draw_Duration", "Refresh_Duration", "Response_Latency", "Response_Offset"]
+# Share of the widening of the spin margin still kept after each sleep on time
+spin_decay = 0.8
+
+
+#==============================================================================
+# Clock
+#==============================================================================
+class Clock():
+    """
+    Monotonic, high-resolution clock (time.perf_counter_ns, or another counter of nanoseconds such
+    as a virtual clock), anchored once to the wall clock.
+    """
+    def __init__(self, counter=None):
+        self.counter = counter if counter is not None else time.perf_counter_ns
+        self.anchor = datetime.datetime.now()
+        self.start = self.counter()
+
+    def now(self):
+        return(self.counter())
+
+    def datetime(self, ns):
+        """
+        Wall-clock date of a reading, without the jumps of the wall clock itself.
+        """
+        return(self.anchor + datetime.timedelta(microseconds=(ns - self.start) / 1000))
+
+    def ms(self, start, end=None):
+        """
+        Milliseconds elapsed between two readings (or since a reading).
+        """
+        if end is None:
+            end = self.now()
+        return((end - start) / 1e6)
+
+
+
+class Scheduler():
+    """
+    Waits until planned readings of a clock: sleeps until shortly before them, then spins on the
+    clock for the rest. The margin left for spinning (ms) widens to cover the sleep overshoots seen
+    on the station, up to max_spin (a refresh period by default), and narrows back to spin once
+    sleeps are on time again. counter() reads the clock (ns) and sleep() sleeps (s), both
+    injectable (e.g., a virtual clock, with a spin of 0 as it only moves when slept).
+    """
+    def __init__(self, counter=None, sleep=None, refresh_rate=60, spin=2.0, max_spin=None):
+        self.counter = counter if counter is not None else time.perf_counter_ns
+        self.sleep = sleep if sleep is not None else time.sleep
+        self.frame = 1000 / refresh_rate
+        self.base = spin
+        self.spin = spin
+        self.max_spin = max(spin, max_spin if max_spin is not None else self.frame)
+
+    def plan(self, intervals):
+        """
+        Intervals (ms) rounded to whole refresh periods (at least one).
+        """
+        frames = np.maximum(np.round(np.asarray(intervals, dtype=float) / self.frame), 1)
+        return(frames * self.frame)
+
+    def wait_until(self, deadline):
+        """
+        Wait until a reading (ns). Returns how late (ms) the wait ended.
+        """
+        awake = deadline - int(self.spin * 1e6)
+        if awake > self.counter():
+            self.sleep((awake - self.counter()) / 1e9)
+            late = (self.counter() - awake) / 1e6
+            if self.spin > 0 and late > self.spin / 2:
+                self.spin = min(late * 2, self.max_spin)
+            elif self.spin > self.base:
+                # A single late sleep (e.g., a pause of the garbage collector) only widens it for a few waits
+                self.spin = self.base + (self.spin - self.base) * spin_decay
+        while self.counter() < deadline:
+            pass
+        return((self.counter() - deadline) / 1e6)
+
+
+#==============================================================================
+# Summary
+#==============================================================================
+def jitter_summary(df, percentiles=(50, 90, 95, 99)):
+    """
+    Distribution of each per-trial latency over a session.
+    """
+    rows = []
+    for measure in timing_measures:
+        values = df[measure].dropna().values.astype(float) if measure in df.columns else np.array([])
+        row = {"Measure": measure, "N": len(values)}
+        if len(values) > 0:
+            row.update({"Mean": values.mean(), "SD": values.std(ddof=1) if len(values) > 1 else np.nan, "Min": values.min()})
+            row.update({"P" + str(p): np.percentile(values, p) for p in percentiles})
+            row["Max"] = values.max()
+        rows.append(row)
+    return(pd.DataFrame(rows))
+
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+Cognitive Control Task: opt-in tracing of the phases of a session and of the steps of each trial.
+Authors: Makowski et al. (under review)
+Copyright: The Neuropsydia Development Team
+Site: https://github.com/DominiqueMakowski/CoCon.py
+
+Spans are saved in the Chrome trace event format (open them in chrome://tracing or
+https://ui.perfetto.dev). While tracing is off, spans and steps are shared no-op objects.
+"""
+
+import json
+import os
+import threading
+import time
+
+#==============================================================================
+# Initialization
+#==============================================================================
+# The running Tracer (None when tracing is off)
+tracer = None
+
+
+#==============================================================================
+# Tracer
+#==============================================================================
+class Tracer():
+    """
+    Complete events ("X") of every thread, in perf_counter_ns time.
+    """
+    def __init__(self):
+        self.start = time.perf_counter_ns()
+        self.pid = os.getpid()
+        self.events = []
+        self.threads = {}
+
+    def add(self, name, category, start, end, args=None):
+        thread = threading.current_thread()
+        self.threads[thread.ident] = thread.name
+        self.events.append((name, category, start, end, thread.ident, args))
+
+    def trace(self):
+        """
+        The events as a Chrome trace (timestamps and durations in microseconds).
+        """
+        events = [{"name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid, "args": {"name": name}}
+                  for tid, name in self.threads.items()]
+        for name, category, start, end, tid, args in self.events:
+            event = {"name": name, "cat": category, "ph": "X", "pid": self.pid, "tid": tid,
+                     "ts": (start - self.start) / 1000, "dur": (end - start) / 1000}
+            if args:
+                event["args"] = args
+            events.append(event)
+        return({"traceEvents": events, "displayTimeUnit": "ms"})
+
+    def save(self, filename):
+        if os.path.dirname(filename) != "" and os.path.exists(os.path.dirname(filename)) is False:
+            os.makedirs(os.path.dirname(filename))
+        with open(filename, "w") as file:
+            json.dump(self.trace(), file)
+
+
+
+class Span():
+    """
+    Context manager adding a span around its block.
+    """
+    __slots__ = ("tracer", "name", "category", "args", "start")
+
+    def __init__(self, tracer, name, category, args):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return(self)
+
+    def __exit__(self, *exception):
+        self.tracer.add(self.name, self.category, self.start, time.perf_counter_ns(), self.args)
+        return(False)
+
+
+
+class Steps():
+    """
+    A span divided into consecutive steps: mark() ends the current step and starts the next one,
+    end() ends the last step and the span.
+    """
+    __slots__ = ("tracer", "name", "category", "args", "start", "step", "step_start")
+
+    def __init__(self, tracer, name, category, args):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+        self.start = time.perf_counter_ns()
+        self.step = None
+        self.step_start = self.start
+
+    def mark(self, step):
+        now = time.perf_counter_ns()
+        if self.step is not None:
+            self.tracer.add(self.step, self.category, self.step_start, now)
+        self.step = step
+        self.step_start = now
+
+    def end(self):
+        self.mark(None)
+        self.tracer.add(self.name, self.category, self.start, self.step_start, self.args)
+
+
+
+class Off():
+    """
+    What span() and steps() return while tracing is off.
+    """
+    def __enter__(self):
+        return(self)
+
+    def __exit__(self, *exception):
+        return(False)
+
+    def mark(self, step):
+        pass
+
+    def end(self):
+        pass
+
+off = Off()
+
+
+#==============================================================================
+# Hooks
+#==============================================================================
+def span(name, category="phase", **args):
+    if tracer is None:
+        return(off)
+    return(Span(tracer, name, category, args))
+
+
+
+def steps(name, category="phase", **args):
+    if tracer is None:
+        return(off)
+    return(Steps(tracer, name, category, args))
+
+
+
+def start():
+    global tracer
+    tracer = Tracer()
+    return(tracer)
+
+
+
+def stop(filename=None):
+    """
+    Stop tracing, and save the trace if a filename is given.
+    """
+    global tracer
+    stopped, tracer = tracer, None
+    if stopped is not None and filename is not None:
+        stopped.save(filename)
+    return(stopped)
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""
+Cognitive Control Task: crash-safe trial log and session recovery.
+Authors: Makowski et al. (under review)
+Copyright: The Neuropsydia Development Team
+Site: https://github.com/DominiqueMakowski/CoCon.py
+
+Usage: python triallog.py ./Data/Log/<participant>_<date> [--output ./Data/]
+"""
+
+import argparse
+import glob
+import json
+import os
+import queue
+import sys
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+import scoring
+import sequences
+
+#==============================================================================
+# Initialization
+#==============================================================================
+# Shortest time left in a window (s) to start a write in it
+write_time = 0.1
+# Attempts at writing the last records when the log is closed
+close_attempts = 3
+
+
+#==============================================================================
+# Log
+#==============================================================================
+def trial_record(trials, order):
+    """
+    One trial of a trial store, as written to the log (the values of trial_sequence()).
+    """
+    record = {}
+    for column, values in trials.items():
+        if isinstance(values, np.ndarray) is False:
+            record[column] = values
+        elif column in sequences.categories:
+            record[column] = sequences.categories[column][values[order]]
+        elif column == "Response_Correct":
+            record[column] = "NA" if np.isnan(values[order]) else int(values[order])
+        elif np.issubdtype(values.dtype, np.datetime64):
+            record[column] = str(values[order])
+        else:
+            record[column] = None if values[order] != values[order] else values[order].item()
+    return(record)
+
+
+
+class TrialLog():
+    """
+    Append-only log of the trials of a session (JSON lines, fsync'd), with a columnar checkpoint
+    of each finished block. Records are written by a background thread, and only within the windows
+    opened by release() and closed by hold(): run_trials() opens one for each prestimulus interval,
+    and one between blocks. A write only starts with at least write_time left in the window, and
+    is not waited for by hold(), so that the disk is not written to from the stimulus onset to the
+    response. A write that fails (e.g., a full disk) is reported, and tried again with the next
+    records, or again after a pause when the log is closed.
+    """
+    def __init__(self, filename, session=None):
+        if os.path.dirname(filename) != "" and os.path.exists(os.path.dirname(filename)) is False:
+            os.makedirs(os.path.dirname(filename))
+        self.filename = filename
+        self.block = 1
+        self.file = open(filename + ".jsonl", "ab", buffering=0)
+        self.records = queue.Queue()
+        self.window = threading.Condition()
+        # End of the current window (perf_counter_ns, None if open until held, False if held)
+        self.until = None
+        self.error = None
+        # Records that could not be written when the log was closed
+        self.lost = 0
+        self.thread = threading.Thread(target=self.write, daemon=True)
+        self.thread.start()
+        if session is not None:
+            self.records.put({"Session": {key: str(value) for key, value in session.items()}})
+
+    def append(self, trials, order):
+        record = trial_record(trials, order)
+        record["Block"] = self.block
+        self.records.put(record)
+
+    def hold(self):
+        """
+        Close the window (a write in progress ends on its own, within write_time).
+        """
+        with self.window:
+            self.until = False
+
+    def release(self, duration=None):
+        """
+        Open a window for duration seconds (or until held).
+        """
+        with self.window:
+            self.until = None if duration is None else time.perf_counter_ns() + int(duration * 1e9)
+            self.window.notify_all()
+
+    def writable(self):
+        if self.until is None:
+            return(True)
+        return(self.until is not False and self.until - time.perf_counter_ns() > write_time * 1e9)
+
+    def write(self):
+        batch = []
+        closing = False
+        attempts = 0
+        while True:
+            if closing is False:
+                batch.append(self.records.get())
+                while self.records.empty() is False:
+                    batch.append(self.records.get())
+                closing = batch[-1] is None
+            with self.window:
+                # Checked under the lock that hold() takes, the write itself is not
+                while self.writable() is False:
+                    self.window.wait()
+            position = self.file.seek(0, os.SEEK_END)
+            try:
+                data = memoryview("".join(json.dumps(record) + "\n" for record in batch if record is not None).encode("utf-8"))
+                while len(data) > 0:
+                    data = data[self.file.write(data):]
+                os.fsync(self.file.fileno())
+            except Exception as error:
+                # Drop what was written of the batch, so that the log stays readable
+                try:
+                    self.file.truncate(position)
+                except OSError:
+                    pass
+                if self.error is None:
+                    print("CoCon: trials could not be logged to " + self.filename + ".jsonl (" + repr(error) + "), they are tried again with the next ones.", file=sys.stderr)
+                self.error = error
+                if closing is True:
+                    # No records will come after these: try them again after a pause, then give up
+                    attempts += 1
+                    if attempts >= close_attempts:
+                        self.lost = sum(record is not None for record in batch)
+                        return
+                    time.sleep(write_time)
+                continue
+            self.error = None
+            batch = []
+            if closing is True:
+                return
+
+    def checkpoint(self, trials):
+        """
+        Save a finished block as columns, and move on to the next block.
+        """
+        filename = self.filename + "_block" + str(self.block) + ".npz"
+        with open(filename + ".tmp", "wb") as checkpoint:
+            np.savez(checkpoint, **trials)
+            checkpoint.flush()
+            os.fsync(checkpoint.fileno())
+        os.replace(filename + ".tmp", filename)
+        self.block += 1
+
+    def close(self):
+        self.records.put(None)
+        self.release()
+        self.thread.join()
+        self.file.close()
+        if self.error is not None:
+            # The session itself is still saved
+            print("CoCon: the trial log " + self.filename + ".jsonl is incomplete, its last " + str(self.lost) + " records could not be written (" + repr(self.error) + ").", file=sys.stderr)
+
+
+
+#==============================================================================
+# Recovery
+#==============================================================================
+def read_log(filename):
+    """
+    Session infos and trials of a log, up to the last complete record.
+    """
+    session, records = {}, []
+    with open(filename + ".jsonl", "r", encoding="utf-8") as log:
+        for line in log:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            if "Session" in record:
+                session = record["Session"]
+            else:
+                records.append(record)
+    return(session, pd.DataFrame(records))
+
+
+
+def read_checkpoint(filename):
+    checkpoint = np.load(filename)
+    return({column: checkpoint[column].item() if checkpoint[column].ndim == 0 else checkpoint[column] for column in checkpoint.files})
+
+
+
+def recover(filename):
+    """
+    Rebuild and score what a session completed: the checkpointed blocks, and the logged trials of the others.
+    """
+    session, trials = read_log(filename)
+    checkpoints = {int(name[len(filename + "_block"):-4]): name for name in glob.glob(filename + "_block*.npz")}
+    blocks = sorted(set(checkpoints) | set(trials["Block"] if len(trials) > 0 else []))
+
+    dfs = []
+    for block in blocks:
+        if block in checkpoints:
+            dfs.append(scoring.statistics(sequences.trial_frame(read_checkpoint(checkpoints[block]))))
+        else:
+            dfs.append(scoring.statistics(trials[trials["Block"]==block].drop(columns="Block").reset_index(drop=True)))
+    if len(dfs) == 0:
+        raise ValueError("CoCon: no trial to recover in " + filename + ".")
+
+    df = scoring.processing(dfs)
+    for column, value in session.items():
+        df[column] = value
+    return(df)
+
+
+
+#==============================================================================
+# Run
+#==============================================================================
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Recover and score an interrupted CoCon session from its trial log.")
+    parser.add_argument("log", help="Trial log, without extension (e.g., ./Data/Log/P01_2019-01-01_10-00-00).")
+    parser.add_argument("--output", default="./Data/", help="Folder to write the recovered session to.")
+    args = parser.parse_args(args)
+
+    df = recover(args.log)
+    filename = os.path.join(args.output, os.path.basename(args.log) + "_CoCon_recovered.csv")
+    df.to_csv(filename, index=False)
+    print("CoCon: " + str(len(df)) + " trials recovered into " + filename)
+
+
+if __name__ == "__main__":
+    main()
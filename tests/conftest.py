@@ -0,0 +1,9 @@
+# -*- coding: utf-8 -*-
+"""
+The modules of the task are imported by name, as they are from the CoCon folder.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "CoCon"))
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pandas as pd
+import pytest
+
+import cohort
+
+
+def session(participant, start, order):
+    return(pd.DataFrame({"Order": order, "RT": np.linspace(300, 400, len(order)), "Conflict": "Neutral",
+                         "Participant_ID": participant, "Experiment_Start": start, "Experiment_End": start,
+                         "Version": "1.10", "Experiment_Duration": 1.5}))
+
+
+def test_integers_and_ids_keep_their_type(tmp_path):
+    session("007", "2019-01-01 10:00:00", [1, 2, 3]).to_csv(tmp_path / "a.csv", index=False)
+    session("008", "2019-01-02 10:00:00", [1, None, 3]).to_csv(tmp_path / "b.csv", index=False)
+    assert cohort.ingest([str(tmp_path / "a.csv"), str(tmp_path / "b.csv")], str(tmp_path / "store")) == 2
+
+    store = cohort.Cohort(str(tmp_path / "store"))
+    order = store.values("Order")
+    assert order.dtype == np.int64
+    assert list(order) == [1, 2, 3, 1, cohort.missing["int64"], 3]
+    assert store.levels("Participant_ID") == ["007", "008"]
+    assert store.levels("Version") == ["1.10"]
+    assert len(store.ranges(Participant_ID="007", Version="1.10")) == 1
+
+
+def test_non_integers_are_refused_by_integer_columns():
+    with pytest.raises(ValueError):
+        cohort.encode({"dtype": "int64"}, [1, 2.5])
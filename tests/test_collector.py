@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import contextlib
+import socket
+
+import pandas as pd
+
+import collector
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return(sock.getsockname()[1])
+
+
+async def collect(output, frames):
+    """
+    Send each table to a local collector in turn, returning the statuses of its batches.
+    """
+    port = free_port()
+    ready = asyncio.Event()
+    server = asyncio.ensure_future(collector.Collector(output).serve("127.0.0.1", port, ready))
+    await ready.wait()
+    try:
+        return([sorted(set((await collector.send(collector.session_batches(frame, "station"), "127.0.0.1:" + str(port), timeout=5)).values())) for frame in frames])
+    finally:
+        server.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await server
+
+
+def test_stored_duplicate_and_rejected_batches(tmp_path, monkeypatch):
+    monkeypatch.setattr(collector, "batch_size", 4)
+    df = pd.DataFrame({"Participant_ID": "P01", "Experiment_Start": "2019-01-01 10:00:00",
+                       "Order": range(10), "RT": [float(rt) for rt in range(300, 310)]})
+    output = str(tmp_path / "cohort.csv")
+
+    assert asyncio.run(collect(output, [df, df, df.assign(Extra=1)])) == [["stored"], ["duplicate"], ["rejected"]]
+    # The stored batches are known to the next collector
+    assert asyncio.run(collect(output, [df])) == [["duplicate"]]
+
+    stored = pd.read_csv(output)
+    assert list(stored.columns) == list(df.columns)
+    assert stored["Order"].tolist() == list(range(10))
+    with open(output + ".ids") as ids:
+        assert len(ids.read().split()) == 3
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+import CoCon
+import schedules
+import sequences
+
+
+@pytest.mark.parametrize("number", range(len(sequences.blocks)))
+def test_constrained_adaptive_blocks_keep_the_constraints(monkeypatch, number):
+    monkeypatch.setattr(CoCon, "constrained_sequences", True)
+    monkeypatch.setattr(CoCon, "adaptive_se", 15)
+    block = sequences.blocks[number]
+    rng = np.random.default_rng(number)
+    for repeat in range(5):
+        trials = CoCon.block_trials(block["Condition_Response_Selection"], block["Condition_Inhibition"], block["Condition_Conflict"], rng)
+        table = {column: values[np.newaxis] for column, values in trials.items() if isinstance(values, np.ndarray)}
+        assert not schedules.violations(table).any()
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+import glob
+import os
+import threading
+
+import pytest
+
+import CoCon
+import headless
+
+
+@pytest.fixture
+def station(tmp_path, monkeypatch):
+    """
+    A folder to run sessions in, with the stimuli of the task.
+    """
+    os.symlink(os.path.join(os.path.dirname(os.path.abspath(CoCon.__file__)), "Stimuli"), str(tmp_path / "Stimuli"))
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(CoCon, "testmode", False)
+    monkeypatch.setattr(CoCon, "trace", True)
+    return(tmp_path)
+
+
+def test_aborted_session_releases_the_screen_and_saves_its_trace(station):
+    display = headless.Display(seed=0, responses=[("DOWN", 400)]*10 + [("ESCAPE", 300)])
+    closed = []
+    display.close = lambda *args, **kwargs: closed.append(True)
+    with pytest.raises(KeyboardInterrupt):
+        CoCon.main(display=display)
+    assert closed == [True]
+    assert len(glob.glob("./Data/Traces/*.json")) == 1
+    assert [thread.name for thread in threading.enumerate() if thread.name.startswith("ThreadPoolExecutor")] == []
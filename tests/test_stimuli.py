@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+import os
+
+import pytest
+
+import headless
+import sequences
+import stimuli
+
+
+@pytest.fixture
+def display(monkeypatch):
+    pygame = pytest.importorskip("pygame")
+    monkeypatch.setenv("SDL_VIDEODRIVER", "dummy")
+    monkeypatch.chdir(os.path.dirname(os.path.abspath(stimuli.__file__)))
+    pygame.init()
+    return(headless.Display(screen_height=200, screen_width=356))
+
+
+def test_cache_composites_ahead_within_its_budget(display):
+    trials = stimuli.trial_stimuli(sequences.trial_store("Conditional", True, True, rng=0))[:40]
+    # Room for a few composites only
+    cache = stimuli.StimulusCache(display)
+    cache.compose(trials[0])
+    size = max(cache.sizes.values())
+    cache.close()
+
+    cache = stimuli.StimulusCache(display, budget=4*size)
+    for future in cache.prepare(trials):
+        future.result()
+    assert 0 < len(cache) <= 4
+    for trial in trials:
+        name = cache.compose(trial)
+        assert cache.key(name) in cache
+        assert cache.memory <= cache.budget
+    cache.close()
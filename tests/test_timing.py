@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+import timing
+
+
+class FakeClock():
+    """
+    A virtual clock: each reading moves it by 1 us, and the next sleep is late by pause (ms).
+    """
+    def __init__(self, pause=0.0):
+        self.ns = 0
+        self.pause = pause
+
+    def counter(self):
+        self.ns += 1000
+        return(self.ns)
+
+    def sleep(self, seconds):
+        self.ns += int(seconds * 1e9 + self.pause * 1e6)
+        self.pause = 0.0
+
+
+def margins(clock, scheduler, waits=30):
+    spins = []
+    for wait in range(waits):
+        scheduler.wait_until(clock.ns + int(500 * 1e6))
+        spins.append(scheduler.spin)
+    return(spins)
+
+
+def test_plan_rounds_to_refreshes():
+    scheduler = timing.Scheduler(refresh_rate=60)
+    assert np.allclose(scheduler.plan([10, 33.3, 95, 2000]), [1000/60, 2000/60, 6000/60, 120000/60])
+
+
+def test_wait_ends_on_time():
+    clock = FakeClock()
+    scheduler = timing.Scheduler(clock.counter, clock.sleep)
+    deadline = clock.ns + int(250 * 1e6)
+    assert 0 <= scheduler.wait_until(deadline) < 0.01
+
+
+def test_late_sleep_widens_the_margin_up_to_a_refresh():
+    clock = FakeClock(pause=40.0)
+    scheduler = timing.Scheduler(clock.counter, clock.sleep, refresh_rate=60, spin=2.0)
+    spins = margins(clock, scheduler)
+    assert spins[0] == scheduler.max_spin == 1000/60
+    assert max(spins) <= scheduler.max_spin
+
+
+def test_margin_narrows_back_after_a_late_sleep():
+    clock = FakeClock(pause=40.0)
+    scheduler = timing.Scheduler(clock.counter, clock.sleep, refresh_rate=60, spin=2.0)
+    spins = margins(clock, scheduler)
+    assert all(later < earlier for earlier, later in zip(spins, spins[1:]))
+    assert spins[-1] < 2.0 * 1.05
+
+
+def test_margin_stays_put_without_late_sleeps():
+    clock = FakeClock()
+    scheduler = timing.Scheduler(clock.counter, clock.sleep, spin=2.0)
+    assert margins(clock, scheduler, 10) == [2.0]*10
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+import os
+import threading
+import time
+
+import triallog
+
+
+def test_hold_does_not_wait_for_the_fsync(tmp_path, monkeypatch):
+    fsync = os.fsync
+    syncing, done = threading.Event(), threading.Event()
+
+    def slow_fsync(fd):
+        syncing.set()
+        done.wait(5)
+        fsync(fd)
+    monkeypatch.setattr(os, "fsync", slow_fsync)
+
+    log = triallog.TrialLog(str(tmp_path / "log"), session={"Participant_ID": "P01"})
+    assert syncing.wait(5)
+    start = time.perf_counter()
+    log.hold()
+    assert time.perf_counter() - start < 0.5
+    done.set()
+    log.release()
+    log.close()
+    assert triallog.read_log(str(tmp_path / "log"))[0] == {"Participant_ID": "P01"}
+
+
+def test_the_last_records_are_tried_again_on_close(tmp_path, monkeypatch):
+    fsync = os.fsync
+    calls = []
+
+    def failing_fsync(fd):
+        calls.append(fd)
+        if len(calls) == 1:
+            raise OSError(28, "No space left on device")
+        fsync(fd)
+    monkeypatch.setattr(os, "fsync", failing_fsync)
+
+    log = triallog.TrialLog(str(tmp_path / "log"))
+    log.hold()
+    log.records.put({"Block": 1})
+    log.close()
+    assert log.error is None and log.lost == 0
+    assert len(triallog.read_log(str(tmp_path / "log"))[1]) == 1
+
+
+def test_records_lost_on_close_are_reported(tmp_path, monkeypatch, capsys):
+    def failing_fsync(fd):
+        raise OSError(28, "No space left on device")
+    monkeypatch.setattr(os, "fsync", failing_fsync)
+    monkeypatch.setattr(triallog, "write_time", 0.01)
+
+    log = triallog.TrialLog(str(tmp_path / "log"))
+    log.hold()
+    log.records.put({"Block": 1})
+    log.records.put({"Block": 1})
+    log.close()
+    assert log.lost == 2
+    assert "its last 2 records could not be written" in capsys.readouterr().err
+    assert len(triallog.read_log(str(tmp_path / "log"))[1]) == 0